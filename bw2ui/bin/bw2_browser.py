@@ -66,6 +66,8 @@ from bw2data.query import Filter, Query
 from docopt import docopt
 from tabulate import tabulate
 
+from bw2ui.uncertainty import database_params, params_array, summarize, summary_table
+
 warnings.filterwarnings("ignore", ".*Read only project.*")
 
 FTS5_ENABLED_BD_VERSION = "4.0.dev47"
@@ -123,6 +125,7 @@ string and location LOCATION.
 database with string and category CAT, SUBCAT, SUBCAT [useful for biosphere].
     s -rp {REFERENCE PRODUCT} [string]: Search activities in current database that \
 have reference product and optionnaly match string in search.
+    uns: Summary of the uncertainty information of all exchanges in current database.
 
 Working with activities:
     a id: Go to activity id in current database. Complex ids in quotes.
@@ -136,7 +139,8 @@ by name.
     up: List upstream activities with pedigree info if avail (inputs for the current \
 activity).
     uu: List upstream activities with formula info if avail.
-    un: display uncertainty information of upstream activitities if avail.
+    un: display uncertainty information of upstream activitities if avail, and \
+a summary per uncertainty type.
     d: List downstream activities (activities which consume current activity).
     b: List biosphere flows for the current activity.
     cfs: Show characterization factors for current activity and current method.
@@ -592,7 +596,7 @@ Autosave is turned %(autosave)s.""" % {
                     "pedigree": exc.get("pedigree", None),
                     "loc": exc.get("loc", None),
                     "scale": exc.get("scale", None),
-                    "uncertainty_type": exc.get("uncertainty_type", None),
+                    "uncertainty_type": exc.get("uncertainty type", None),
                     "key": exc["input"],
                 }
             )
@@ -1344,9 +1348,26 @@ Autosave is turned %(autosave)s.""" % {
         if not self.activity:
             print("Need to choose an activity first")
         else:
-            es = get_activity(self.activity).technosphere()
+            es = list(get_activity(self.activity).technosphere())
             self.format_exchanges_as_options(es, "technosphere", show_uncertainty=True)
             self.print_current_options("Upstream inputs")
+            self.print_uncertainty_summary(
+                params_array(exc for exc in es if exc["type"] == "technosphere")
+            )
+
+    def do_uns(self, arg):
+        """Summary of the uncertainty information of the current database"""
+        if not self.database:
+            print("Need to choose a database first")
+        else:
+            self.print_uncertainty_summary(database_params(self.database))
+
+    def print_uncertainty_summary(self, params):
+        rows, headers = summary_table(summarize(params))
+        if rows:
+            print("Uncertainty summary for %s exchanges" % len(params))
+            self.tabulate_data = tabulate(rows, headers=headers, tablefmt="tsv")
+            print(tabulate(rows, headers=headers, floatfmt=".3g"))
 
     def do_web(self, arg):
         """Open a web browser to current activity"""
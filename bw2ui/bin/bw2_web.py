@@ -3,7 +3,8 @@
 """Brightway2 web user interface.
 
 Usage:
-  bw2-web [--port=<port>] [--nobrowser] [--debug|--insecure]
+  bw2-web [--port=<port>] [--workers=<n>|--async] [--warm] [--nobrowser]
+          [--debug|--insecure]
   bw2-web -h | --help
   bw2-web --version
 
@@ -13,15 +14,18 @@ Options:
   --nobrowser   Don't automatically open a browser tab.
   --debug       Use Werkzeug debug mode (only for development).
   --insecure    Allow outside connections (insecure!). Not with --debug.
+  --workers=<n>  Serve with n pre-forked worker processes (needs gunicorn).
+  --async       Serve with an event loop (needs uvicorn): status streams don't
+                need a thread each, and each route class has its own thread pool.
+  --warm        Fill caches in the background at startup.
 
 """
 from __future__ import print_function, unicode_literals
 from eight import *
 
-from bw2data import projects
+from bw2data import preferences, projects
 from bw2ui.web import bw2webapp
 from docopt import docopt
-# from werkzeug.serving import run_simple
 import logging
 import os
 import threading
@@ -33,15 +37,13 @@ def main():
     port = int(args.get("--port", False) or 5000)  # + random.randint(0, 999))
     host = "0.0.0.0" if args.get("--insecure", False) else "localhost"
     debug = args["--debug"]
+    workers = int(args.get("--workers") or 1)
+    warm = args["--warm"] or preferences.get("web warm", False)
 
     if not args["--nobrowser"]:
         url = "http://127.0.0.1:{}".format(port)
         threading.Timer(1., lambda: webbrowser.open_new_tab(url)).start()
 
-    # kwargs = {
-    #     "processes": args.get("<processes>", 0) or 3,
-    # }
-
     if not debug:
         handler = logging.handlers.RotatingFileHandler(
             os.path.join(projects.logs_dir, "web-ui-error.log"),
@@ -60,9 +62,25 @@ Message:
 
         bw2webapp.logger.addHandler(handler)
 
-    bw2webapp.run(host=host, port=port, debug=debug)
-    # run_simple disabled because multiple workers cause cache conflicts...
-    # run_simple(host, port, bw2webapp, use_evalex=True, **kwargs)
+    if warm:
+        # Report warm-up timings on the console
+        console = logging.StreamHandler()
+        console.setLevel(logging.INFO)
+        bw2webapp.logger.addHandler(console)
+        bw2webapp.logger.setLevel(logging.INFO)
+
+    if args["--async"] and not debug:
+        from bw2ui.web.server import serve_async
+        serve_async(host, port, warm=warm)
+    elif workers > 1 and not debug:
+        from bw2ui.web.server import serve
+        serve(bw2webapp, host, port, workers, warm=warm)
+    else:
+        # In debug mode, only the reloader's serving child process warms
+        if warm and not (debug and os.environ.get("WERKZEUG_RUN_MAIN") != "true"):
+            from bw2ui.web.warm import start_warming
+            start_warming()
+        bw2webapp.run(host=host, port=port, debug=debug)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from stats_arrays import (
+    LognormalUncertainty,
+    NormalUncertainty,
+    TriangularUncertainty,
+    UniformUncertainty,
+    uncertainty_choices,
+)
+from stats_arrays.utils import construct_params_array
+import numpy as np
+
+try:
+    from bw2data.backends import ExchangeDataset
+except ImportError:
+    from bw2data.backends.peewee import ExchangeDataset
+
+# ``uncertainty_type`` of exchanges without uncertainty information
+NOT_GIVEN = 255
+
+FIELDS = ("loc", "scale", "shape", "minimum", "maximum")
+
+
+def params_dtype():
+    """``stats_arrays`` parameter array layout, plus the exchange ``amount``"""
+    return np.dtype(
+        construct_params_array(0, include_type=True).dtype.descr
+        + [(str("amount"), np.float64)]
+    )
+
+
+def number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def column(exchanges, field, default=np.nan):
+    values = [exc.get(field, default) for exc in exchanges]
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        # ``None`` or text somewhere
+        return np.array([
+            default if value is None else number(value) for value in values
+        ], dtype=np.float64)
+
+
+def params_array(exchanges):
+    """Uncertainty parameters of exchange dictionaries as one structured array"""
+    exchanges = list(exchanges)
+    params = np.zeros(len(exchanges), dtype=params_dtype())
+    for field in FIELDS + ("amount",):
+        params[field] = column(exchanges, field)
+    kinds = column(exchanges, "uncertainty type", NOT_GIVEN)
+    kinds[~np.isfinite(kinds) | (kinds < 0) | (kinds > NOT_GIVEN)] = NOT_GIVEN
+    params["uncertainty_type"] = kinds
+    params["negative"] = [bool(exc.get("negative", False)) for exc in exchanges]
+    return params
+
+
+def database_params(database, chunk_size=100000):
+    """``params_array`` of all exchanges of ``database``, built in chunks"""
+    query = ExchangeDataset.select(ExchangeDataset.data).where(
+        ExchangeDataset.output_database == database
+    ).tuples().iterator()
+    chunks, exchanges = [], []
+    for (data,) in query:
+        exchanges.append(data)
+        if len(exchanges) >= chunk_size:
+            chunks.append(params_array(exchanges))
+            exchanges = []
+    chunks.append(params_array(exchanges))
+    return np.concatenate(chunks)
+
+
+def invalid_params(params):
+    """Boolean array of exchanges with invalid uncertainty parameters"""
+    kinds = params["uncertainty_type"]
+    loc, scale = params["loc"], params["scale"]
+    minimum, maximum = params["minimum"], params["maximum"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_amount = np.log(np.abs(params["amount"]))
+        positive_scale = scale > 0
+        bounded = minimum < maximum
+        return (
+            ((kinds == LognormalUncertainty.id)
+             & ~(positive_scale & np.isclose(log_amount, loc, rtol=1e-3)))
+            | ((kinds == NormalUncertainty.id)
+               & ~(positive_scale & np.isclose(params["amount"], loc)))
+            | ((kinds == UniformUncertainty.id) & ~bounded)
+            | ((kinds == TriangularUncertainty.id)
+               & ~(bounded & (minimum <= loc) & (loc <= maximum)))
+        )
+
+
+def quartiles(values):
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return None
+    return dict(zip(("min", "q1", "median", "q3", "max"),
+                    np.percentile(values, [0, 25, 50, 75, 100]).tolist()))
+
+
+def summarize(params):
+    """Counts, invalid parameters and quartiles of the width per uncertainty type"""
+    kinds = params["uncertainty_type"]
+    invalid = invalid_params(params)
+    totals = np.bincount(kinds, minlength=NOT_GIVEN + 1)
+    bad = np.bincount(kinds[invalid], minlength=NOT_GIVEN + 1)
+    summary = []
+    for kind in np.nonzero(totals)[0]:
+        selected = params[(kinds == kind) & ~invalid]
+        if kind in (LognormalUncertainty.id, NormalUncertainty.id):
+            statistic, values = "scale", selected["scale"]
+        elif kind in (TriangularUncertainty.id, UniformUncertainty.id):
+            statistic = "relative width"
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = (selected["maximum"] - selected["minimum"]) / np.abs(
+                    selected["amount"])
+        else:
+            statistic, values = None, selected["amount"][:0]
+        summary.append({
+            "id": int(kind),
+            "name": description(kind),
+            "total": int(totals[kind]),
+            "bad": int(bad[kind]),
+            "statistic": statistic,
+            "quartiles": quartiles(values),
+        })
+    summary.sort(key=lambda x: x["total"], reverse=True)
+    return summary
+
+
+def description(kind):
+    if kind == NOT_GIVEN:
+        return "No uncertainty information"
+    try:
+        return uncertainty_choices[kind].description
+    except KeyError:
+        return "Unknown uncertainty type %s" % kind
+
+
+def summary_table(summary):
+    """Rows and headers for ``tabulate``"""
+    headers = ["uncertainty type", "exchanges", "invalid", "statistic",
+               "min", "median", "max"]
+    rows = []
+    for row in summary:
+        q = row["quartiles"] or {}
+        rows.append([
+            row["name"], row["total"], row["bad"], row["statistic"] or "",
+            q.get("min", ""), q.get("median", ""), q.get("max", ""),
+        ])
+    return rows, headers
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from .engine import engine
+from .utils import is_finished, status_delta
+from bw2data import JsonWrapper, preferences
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
+import asyncio
+import io
+import json
+import sys
+
+# Route classes by endpoint; other endpoints are in the ``default`` class
+ROUTE_CLASSES = {
+    "job_status": "status",
+    "job_status_stream": "stream",
+    "ping": "status",
+    "prometheus_metrics": "status",
+    "static": "light",
+    "activity_complete": "light",
+    "activity_names": "light",
+    "activity_dataset": "heavy",
+    "activity_dataset-canonical": "heavy",
+    "database_explorer": "heavy",
+    "database_health_check": "heavy",
+    "facet": "heavy",
+    "method_explorer": "heavy",
+    "lca": "heavy",
+    "lca_batch": "heavy",
+    "report": "heavy",
+    "database_tree": "heavy",
+    "database_tree_json": "heavy",
+}
+
+# Requests of each class handled at the same time; see ``AsyncApp``
+DEFAULT_LIMITS = {
+    "stream": 10000,
+    "status": 8,
+    "light": 8,
+    "heavy": 4,
+    "default": 8,
+}
+
+
+class Limit(object):
+    """At most ``size`` requests at a time; others wait up to ``wait`` seconds"""
+
+    def __init__(self, name, size, wait, threads=True):
+        self.name = name
+        self.semaphore = asyncio.Semaphore(size)
+        self.wait = wait
+        self.executor = ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix="bw2web-" + name) if threads else None
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.wait)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def release(self):
+        self.semaphore.release()
+
+
+def wsgi_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        name = "HTTP_" + name
+        environ[name] = environ[name] + "," + value if name in environ else value
+    # The whole body has been read, also for chunked requests
+    environ.pop("HTTP_TRANSFER_ENCODING", None)
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+async def read_body(receive):
+    body = []
+    while True:
+        message = await receive()
+        body.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(body)
+
+
+async def send_response(send, status, body, content_type, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode("latin-1"))] + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AsyncApp(object):
+    """ASGI application for high numbers of concurrent connections.
+
+Job status and status streams are handled on the event loop; other requests go to the
+Flask ``app``, on a thread pool per route class (``ROUTE_CLASSES``)."""
+
+    def __init__(self, app):
+        self.app = app
+        self.urls = app.url_map.bind("localhost")
+        self.limits = None
+
+    def setup(self):
+        # Semaphores belong to the running event loop
+        sizes = dict(DEFAULT_LIMITS, **preferences.get("web async limits", {}))
+        wait = preferences.get("web async wait", 30)
+        self.limits = {
+            name: Limit(name, size, wait, threads=name != "stream")
+            for name, size in sizes.items()
+        }
+
+    def route_class(self, scope):
+        try:
+            endpoint, args = self.urls.match(scope["path"], scope["method"])
+        except HTTPException:
+            return "default", None, {}
+        return ROUTE_CLASSES.get(endpoint, "default"), endpoint, args
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    self.setup()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        if self.limits is None:
+            self.setup()
+        name, endpoint, args = self.route_class(scope)
+        limit = self.limits.get(name) or self.limits["default"]
+        if not await limit.acquire():
+            await send_response(send, 503, b"Too many requests", "text/plain", [
+                (b"retry-after", b"5")])
+            return
+        try:
+            if endpoint == "job_status_stream" and scope["method"] == "GET":
+                await self.status_stream(args["job"], receive, send)
+            elif endpoint == "job_status" and scope["method"] == "GET":
+                await self.status(args["job"], send)
+            else:
+                body = await read_body(receive)
+                await self.call_wsgi(wsgi_environ(scope, body), limit, send)
+        finally:
+            limit.release()
+
+    async def call_wsgi(self, environ, limit, send):
+        """Run the Flask app in a thread of ``limit``, sending chunks as they come"""
+        loop = asyncio.get_running_loop()
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                response["status"] = int(status.split(" ", 1)[0])
+                response["headers"] = [
+                    (key.lower().encode("latin-1"), value.encode("latin-1"))
+                    for key, value in headers
+                ]
+
+            def start():
+                if not response.get("started"):
+                    response["started"] = True
+                    send_sync({"type": "http.response.start",
+                               "status": response["status"],
+                               "headers": response["headers"]})
+
+            iterable = self.app(environ, start_response)
+            try:
+                for chunk in iterable:
+                    if chunk:
+                        start()
+                        send_sync({"type": "http.response.body", "body": chunk,
+                                   "more_body": True})
+                start()
+                send_sync({"type": "http.response.body", "body": b""})
+            finally:
+                if hasattr(iterable, "close"):
+                    iterable.close()
+
+        await loop.run_in_executor(limit.executor, run)
+
+    async def read_status(self, job, version=None):
+        """Current ``(version, status)`` of ``job``, without waiting for changes"""
+        if not engine.store.shared:
+            return engine.store.wait(job, version, 0)
+        # Shared status is read from SQLite, so not on the event loop
+        return await asyncio.get_running_loop().run_in_executor(
+            self.limits["status"].executor, engine.store.wait, job, version, 0)
+
+    async def status(self, job, send):
+        try:
+            _, status = await self.read_status(job)
+        except KeyError:
+            await send_response(send, 404, b"Not found", "text/plain")
+            return
+        await send_response(
+            send, 200, JsonWrapper.dumps(status).encode("utf-8"), "application/json")
+
+    async def status_stream(self, job, receive, send):
+        """Server-Sent Events with the changes to the status of ``job``"""
+        interval = preferences.get("web status interval", 0.25)
+        keepalive = 15
+        try:
+            version, status = await self.read_status(job)
+        except KeyError:
+            await send_response(send, 404, b"Not found", "text/plain")
+            return
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        await read_body(receive)
+        # The next message is ``http.disconnect``
+        disconnected = asyncio.ensure_future(receive())
+        last, quiet = {}, 0
+        try:
+            while True:
+                delta = status_delta(last, status)
+                if delta:
+                    event, quiet = "data: %s\n\n" % json.dumps(delta), 0
+                    last = status
+                elif quiet >= keepalive:
+                    event, quiet = ": keepalive\n\n", 0
+                else:
+                    event = None
+                if event:
+                    await send({"type": "http.response.body",
+                                "body": event.encode("utf-8"), "more_body": True})
+                if is_finished(status):
+                    break
+                await asyncio.wait([disconnected], timeout=interval)
+                if disconnected.done():
+                    return
+                quiet += interval
+                try:
+                    version, status = await self.read_status(job, version)
+                except KeyError:
+                    break
+            await send({"type": "http.response.body",
+                        "body": b"event: end\ndata: {}\n\n"})
+        finally:
+            disconnected.cancel()
+
+
+def create_asgi_app():
+    from . import bw2webapp
+    return AsyncApp(bw2webapp)
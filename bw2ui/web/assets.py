@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+import gzip
+import hashlib
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from werkzeug.utils import safe_join
+except ImportError:
+    from werkzeug.security import safe_join
+
+COMPRESSIBLE_EXTENSIONS = {".css", ".html", ".js", ".json", ".map", ".svg", ".txt"}
+
+# Cache-Control for fingerprinted URLs: a changed file gets a new URL
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class StaticAssets(object):
+    """Content fingerprints and precompressed copies of the files in a static folder"""
+
+    def __init__(self, folder, min_size=1024):
+        self.folder = folder
+        self.min_size = min_size
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def entry(self, filename):
+        filepath = safe_join(self.folder, filename)
+        if filepath is None:
+            return None
+        try:
+            mtime = os.path.getmtime(filepath)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(filename)
+        if entry is not None and entry["mtime"] == mtime:
+            return entry
+        with open(filepath, "rb") as f:
+            content = f.read()
+        entry = {
+            "mtime": mtime,
+            "fingerprint": hashlib.sha1(content).hexdigest()[:12],
+            "compressible": (
+                len(content) >= self.min_size
+                and os.path.splitext(filepath)[1].lower() in COMPRESSIBLE_EXTENSIONS
+            ),
+        }
+        with self.lock:
+            self.entries[filename] = entry
+        return entry
+
+    def fingerprint(self, filename):
+        entry = self.entry(filename)
+        return entry["fingerprint"] if entry else None
+
+    def compressed(self, filename, encoding):
+        """Content of ``filename`` compressed with ``encoding``, or ``None``"""
+        entry = self.entry(filename)
+        if not entry or not entry["compressible"]:
+            return None
+        if encoding == "br" and brotli is None:
+            return None
+        if encoding not in entry:
+            with open(safe_join(self.folder, filename), "rb") as f:
+                content = f.read()
+            if encoding == "br":
+                entry[encoding] = brotli.compress(content)
+            else:
+                entry[encoding] = gzip.compress(content, 9)
+        return entry[encoding]
+
+    def precompress(self):
+        """Fingerprint and compress all files, e.g. when warming caches"""
+        for dirpath, dirnames, filenames in os.walk(self.folder):
+            for name in filenames:
+                filename = os.path.relpath(
+                    os.path.join(dirpath, name), self.folder).replace(os.sep, "/")
+                for encoding in ("br", "gzip"):
+                    self.compressed(filename, encoding)
+
+
+assets = StaticAssets(os.path.join(os.path.dirname(__file__), "static"))
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from bw2data import config, databases, methods, projects
+from collections import OrderedDict
+from datetime import datetime, timezone
+import glob
+import hashlib
+import numpy as np
+import os
+import pickle
+import threading
+import time
+
+MISSING = object()
+
+
+def data_version(metadata):
+    """Cheap version token for an entry of ``databases`` or ``methods``."""
+    return (
+        metadata.get("modified"),
+        metadata.get("processed"),
+        metadata.get("number", metadata.get("num_cfs")),
+    )
+
+
+def database_version(name):
+    return data_version(databases[name])
+
+
+def dependency_version(name):
+    """Version token for a database and all databases it depends on"""
+    versions, todo = {}, [name]
+    while todo:
+        name = todo.pop()
+        if name in versions or name not in databases:
+            continue
+        versions[name] = database_version(name)
+        todo.extend(databases[name].get("depends", []))
+    return tuple(sorted(versions.items()))
+
+
+def method_version(method):
+    return data_version(methods[method])
+
+
+def inventory_version(store):
+    """Version of a metadata store like ``databases``, from its file's mtime"""
+    try:
+        return (len(store), os.path.getmtime(store.filepath))
+    except (AttributeError, OSError):
+        return (len(store), None)
+
+
+def project_version():
+    """Version token for everything a page of the current project can show"""
+    return (
+        projects.current,
+        tuple(sorted(project.name for project in projects)),
+        len(databases),
+        max([value.get("modified") or "" for value in databases.values()] or [""]),
+        len(methods),
+        max([value.get("modified") or "" for value in methods.values()] or [""]),
+        tuple(config.p.get("preferred lcia method", ())),
+    )
+
+
+def parse_modified(value):
+    """``modified`` timestamp (local ISO time) as a UTC ``datetime``, or ``None``"""
+    try:
+        return datetime.fromisoformat(value).astimezone(timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def project_last_modified():
+    """Time of the latest change to the data of the current project, or ``None``"""
+    version = project_version()
+    times = [parse_modified(version[3]), parse_modified(version[5])]
+    for store in (databases, methods, config.p):
+        try:
+            mtime = os.path.getmtime(store.filepath)
+            times.append(datetime.fromtimestamp(mtime, timezone.utc))
+        except (AttributeError, OSError):
+            pass
+    times = [value for value in times if value is not None]
+    return max(times).replace(microsecond=0) if times else None
+
+
+class FileLock(object):
+    """Lock shared between processes; lock files older than ``stale`` are ignored"""
+
+    def __init__(self, filepath, stale=600):
+        self.filepath = filepath
+        self.stale = stale
+
+    def __enter__(self):
+        while True:
+            try:
+                os.close(os.open(self.filepath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except OSError:
+                try:
+                    if time.time() - os.path.getmtime(self.filepath) > self.stale:
+                        os.remove(self.filepath)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(0.05)
+
+    def __exit__(self, *args):
+        try:
+            os.remove(self.filepath)
+        except OSError:
+            pass
+
+
+class SingleFlight(object):
+    """Runs a function once for concurrent calls with the same key, per project"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.shared = 0
+
+    def do(self, key, func):
+        key = (projects.current,) + tuple(key)
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event()}
+            else:
+                self.shared += 1
+        if not leader:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["value"]
+        try:
+            call["value"] = func()
+            return call["value"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+    def __len__(self):
+        return len(self.calls)
+
+
+class VersionedCache(object):
+    """Thread-safe LRU cache for derived data, per project and version token.
+
+With ``enable_disk``, entries are also stored in the project's ``web-cache`` directory,
+for other worker processes; numpy arrays there are memory-mapped."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = self.misses = self.disk_hits = 0
+        self.disk = False
+        self.flights = SingleFlight()
+
+    def enable_disk(self):
+        self.disk = True
+
+    def get(self, key, version, builder, local=False):
+        """Cached value for ``key``, built with ``builder()`` if missing or outdated.
+
+Use ``local`` for values which can't be pickled; these are kept in this process only."""
+        key = (projects.current,) + tuple(key)
+        with self.lock:
+            if key in self.data and self.data[key][0] == version:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key][1]
+            self.misses += 1
+        return self.flights.do(
+            (key, version), lambda: self.build(key, version, builder, local))
+
+    def build(self, key, version, builder, local):
+        if self.disk and not local:
+            value = self.disk_get(key, version, builder)
+        else:
+            value = builder()
+        with self.lock:
+            self.data[key] = (version, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return value
+
+    def filepath(self, key):
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(projects.request_directory("web-cache"), name)
+
+    def disk_get(self, key, version, builder):
+        filepath = self.filepath(key)
+        value = self.load(filepath, version)
+        if value is MISSING:
+            with FileLock(filepath + ".lock"):
+                # Another process could have finished building in the meantime
+                value = self.load(filepath, version)
+                if value is MISSING:
+                    value = builder()
+                    self.dump(filepath, version, value)
+                    return value
+        self.disk_hits += 1
+        return value
+
+    def load(self, filepath, version):
+        try:
+            with open(filepath + ".pickle", "rb") as f:
+                if pickle.load(f) != version:
+                    return MISSING
+                array_filepath = pickle.load(f)
+                if array_filepath:
+                    return np.load(array_filepath, mmap_mode="r")
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return MISSING
+
+    def dump(self, filepath, version, value):
+        array_filepath = None
+        if isinstance(value, np.ndarray):
+            # Versioned file name, as other processes may still map the old file
+            array_filepath = "%s.%s.npy" % (
+                filepath, hashlib.sha1(repr(version).encode("utf-8")).hexdigest())
+            np.save(array_filepath, value)
+        temp_filepath = "%s.%s.tmp" % (filepath, os.getpid())
+        with open(temp_filepath, "wb") as f:
+            pickle.dump(version, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(array_filepath, f, protocol=pickle.HIGHEST_PROTOCOL)
+            if not array_filepath:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_filepath, filepath + ".pickle")
+        for old in glob.glob(filepath + ".*.npy"):
+            if old != array_filepath:
+                try:
+                    os.remove(old)
+                except OSError:
+                    # Still mapped by another process on Windows
+                    pass
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+cache = VersionedCache()
+flights = SingleFlight()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from .cache import cache, dependency_version, method_version
+from .indexes import activity_ids
+from bw2analyzer import SerializedLCAReport
+from bw2data import config, projects
+from concurrent.futures import as_completed
+from scipy.stats import gaussian_kde
+import bw2calc as bc
+import numpy as np
+import threading
+
+
+def is_legacy_bc():
+    return isinstance(bc.__version__, tuple)
+
+
+def monte_carlo_lca(demand, method, seed=None):
+    """Generator of Monte Carlo LCA scores, for bw2calc 1 and 2"""
+    if is_legacy_bc():
+        mc = bc.MonteCarloLCA(demand, method, seed=seed)
+        while True:
+            yield next(mc)
+    else:
+        lca = bc.LCA(demand, method, use_distributions=True, seed_override=seed)
+        lca.lci()
+        lca.lcia()
+        while True:
+            next(lca)
+            yield lca.score
+
+
+class FactorizedLCA(object):
+    """LCA with a factorized technosphere matrix, reused for other demands.
+
+Calls are serialized, as the LCA object keeps the last demand and method."""
+
+    def __init__(self, demand, method):
+        self.lock = threading.Lock()
+        self.method = method
+        self.lca = bc.LCA(demand, method=method)
+        self.lca.lci(factorize=True)
+        self.lca.lcia()
+        self.cfs = {}
+
+    @property
+    def products(self):
+        """Dictionary from activity key or id to technosphere matrix column"""
+        if is_legacy_bc():
+            return self.lca.product_dict
+        return self.lca.dicts.product
+
+    def product_keys(self, keys):
+        """Dictionary from activity keys to keys of ``products``"""
+        if is_legacy_bc():
+            return {tuple(key): tuple(key) for key in keys}
+        return activity_ids(keys)
+
+    def known(self, keys):
+        """Those of ``keys`` which are in the technosphere matrix"""
+        products = self.products
+        keys = self.product_keys(keys)
+        return {key for key, product in keys.items() if product in products}
+
+    def score(self, demand):
+        keys = self.product_keys(demand)
+        demand = {keys[key]: amount for key, amount in demand.items()}
+        with self.lock:
+            self.lca.redo_lcia(demand)
+            return float(self.lca.score)
+
+    def characterization(self, method):
+        """Characterization factors of ``method`` as a vector over biosphere flows"""
+        version = method_version(method)
+        with self.lock:
+            if method not in self.cfs or self.cfs[method][0] != version:
+                if method == self.method:
+                    matrix = self.lca.characterization_matrix
+                else:
+                    self.lca.switch_method(method)
+                    try:
+                        matrix = self.lca.characterization_matrix
+                    finally:
+                        self.lca.switch_method(self.method)
+                vector = np.asarray(matrix.diagonal()).ravel()
+                self.cfs[method] = (version, vector)
+            return self.cfs[method][1]
+
+    def solve(self, rhs):
+        """Solve for all columns of ``rhs`` with the factorization of the LCA object"""
+        try:
+            solution = self.lca.solver(rhs)
+            if solution.shape == rhs.shape:
+                return solution
+        except (TypeError, ValueError):
+            pass
+        # The UMFPACK solver only takes vectors
+        return np.column_stack(
+            [self.lca.solver(rhs[:, i]) for i in range(rhs.shape[1])])
+
+    def scores(self, demands, methods, block=256, progress=None):
+        """Scores as an array with a row per method and a column per demand.
+
+Demands are solved ``block`` at a time; ``progress(done)`` is called after each."""
+        products = self.products
+        keys = self.product_keys({key for demand in demands for key in demand})
+        columns = [
+            [(products[keys[key]], amount) for key, amount in demand.items()]
+            for demand in demands
+        ]
+        cfs = np.vstack([self.characterization(method) for method in methods])
+        size = self.lca.technosphere_matrix.shape[0]
+        result = np.zeros((len(methods), len(demands)))
+        for start in range(0, len(demands), block):
+            chunk = columns[start:start + block]
+            rhs = np.zeros((size, len(chunk)))
+            for column, entries in enumerate(chunk):
+                for row, amount in entries:
+                    rhs[row, column] += amount
+            inventory = self.lca.biosphere_matrix.dot(self.solve(rhs))
+            result[:, start:start + len(chunk)] = cfs.dot(inventory)
+            if progress:
+                progress(start + len(chunk))
+        return result
+
+
+def dependency_closure(names):
+    """Names and versions of ``names`` and all databases they depend on"""
+    return tuple(sorted({item for name in names for item in dependency_version(name)}))
+
+
+def factorized_lca(demand, method):
+    """Cached ``FactorizedLCA`` for the databases of the activities in ``demand``.
+
+Shared by all demands with the same dependency closure. Factorizations can't be stored
+on disk, so with several server workers each worker builds and keeps its own."""
+    closure = dependency_closure({key[0] for key in demand})
+    return cache.get(
+        ("factorized-lca", tuple(name for name, _ in closure), method),
+        (closure, method_version(method)),
+        lambda: FactorizedLCA(dict(demand), method),
+        local=True
+    )
+
+
+def batch_scores(demands, methods, progress=None):
+    """LCA scores for every combination of ``demands`` and ``methods``"""
+    preferred = tuple(config.p.get("preferred lcia method", ()))
+    base = preferred if preferred in methods else methods[0]
+    combined = {key: 1 for demand in demands for key in demand}
+    return factorized_lca(combined, base).scores(demands, methods, progress=progress)
+
+
+def monte_carlo_chunk(project, demand, method, iterations, seed=None):
+    """Process pool worker: ``iterations`` Monte Carlo scores"""
+    if projects.current != project:
+        projects.set_current(project, writable=False)
+    scores = monte_carlo_lca(demand, method, seed)
+    return [float(next(scores)) for _ in range(iterations)]
+
+
+def monte_carlo_statistics(scores, outliers=0.025):
+    """Summary statistics as shown in reports; works on partial results as well"""
+    data = np.sort(np.asarray(scores))
+    offset = int(outliers * data.shape[0])
+    if offset:
+        lower, upper = data[offset], data[-offset]
+        data = data[offset:-offset]
+    else:
+        lower, upper = data[0], data[-1]
+    return {
+        "median": float(np.median(data)),
+        "mean": float(np.mean(data)),
+        "interval": [float(lower), float(upper)],
+    }
+
+
+class ProgressLCAReport(SerializedLCAReport):
+    """``SerializedLCAReport`` with Monte Carlo in chunks on a process pool.
+
+``progress(done, statistics)`` is called after every chunk; raising there stops."""
+
+    def __init__(self, activity, method, iterations, executor, progress,
+                 chunks=None, cpus=None, uuid=None):
+        super(ProgressLCAReport, self).__init__(activity, method, iterations, cpus)
+        if uuid:
+            self.uuid = uuid
+        self.executor = executor
+        self.progress = progress
+        self.chunks = chunks or 4 * (cpus or 1)
+
+    def calculate(self):
+        iterations, self.iterations = self.iterations, 0
+        super(ProgressLCAReport, self).calculate()
+        self.report["metadata"]["partial"] = True
+        self.write()
+        self.iterations = iterations
+        self.report["monte carlo"] = self.get_monte_carlo()
+        del self.report["metadata"]["partial"]
+
+    def get_monte_carlo(self):
+        if not self.iterations:
+            return None
+        size = max(1, self.iterations // self.chunks)
+        sizes = [size] * (self.iterations // size)
+        if self.iterations % size:
+            sizes.append(self.iterations % size)
+        futures = [
+            self.executor.submit(
+                monte_carlo_chunk, projects.current, self.activity, self.method,
+                n, np.random.randint(0, 2 ** 31)
+            ) for n in sizes
+        ]
+        scores = []
+        try:
+            for future in as_completed(futures):
+                scores.extend(future.result())
+                self.progress(
+                    len(scores), monte_carlo_statistics(scores, self.outliers))
+        finally:
+            for future in futures:
+                future.cancel()
+        return self.summarize_monte_carlo(scores)
+
+    def summarize_monte_carlo(self, scores):
+        """``SerializedLCAReport.get_monte_carlo``, from already calculated scores"""
+        mc_data = np.sort(np.array(scores))
+        if np.unique(mc_data).shape[0] == 1:
+            # No uncertainty in database
+            return None
+        statistics = monte_carlo_statistics(mc_data, self.outliers)
+        offset = int(self.outliers * mc_data.shape[0])
+        if offset:
+            mc_data = mc_data[offset:-offset]
+        num_bins = max(100, min(20, int(np.sqrt(self.iterations))))
+        kde = gaussian_kde(mc_data)
+        kde_xs = np.linspace(mc_data.min(), mc_data.max(), 500)
+        kde_ys = kde.evaluate(kde_xs)
+        hist_ys, hist_xs = np.histogram(mc_data, bins=num_bins, density=True)
+        hist_xs = np.repeat(hist_xs, 2)
+        hist_ys = np.hstack((np.array(0), np.repeat(hist_ys, 2), np.array(0)))
+        return {
+            "smoothed": list(zip(kde_xs.tolist(), kde_ys.tolist())),
+            "histogram": list(zip(hist_xs.tolist(), hist_ys.tolist())),
+            "statistics": statistics,
+        }
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from bw2data import config, projects
+from collections import Counter
+from contextlib import contextmanager
+import functools
+import threading
+
+PROJECT_COOKIE = "bw2-project"
+
+
+class ProjectBusy(Exception):
+    """Another project stayed in use for longer than the wait timeout"""
+
+
+class ProjectGate(object):
+    """Run requests and short jobs in the project they belong to.
+
+bw2data keeps the current project in process-global state, so only one project can be
+used at a time; other projects wait until the current one isn't used anymore. Long jobs
+run in processes of their own (see ``JobEngine.run_in_process``) and don't hold the
+gate."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.active = 0
+        self.jobs = 0
+        self.waiting = Counter()
+        self.local = threading.local()
+
+    def _may_enter(self, project):
+        if not self.active and not self.jobs:
+            return True
+        if projects.current != project:
+            return False
+        # Wait behind switches to other projects, so they aren't starved; unless a job
+        # keeps the current project anyway
+        return bool(self.jobs) or not any(
+            count for name, count in self.waiting.items() if name != project
+        )
+
+    @contextmanager
+    def use(self, project, timeout=None, job=False):
+        """Use ``project`` in this thread; ``ProjectBusy`` after ``timeout`` seconds"""
+        if getattr(self.local, "project", None) == project:
+            # Nested use in the same thread
+            yield
+            return
+        with self.condition:
+            self.waiting[project] += 1
+            try:
+                entered = self.condition.wait_for(
+                    lambda: self._may_enter(project), timeout)
+                if not entered:
+                    raise ProjectBusy(projects.current)
+            finally:
+                self.waiting[project] -= 1
+            if projects.current != project:
+                projects.set_current(project)
+            if job:
+                self.jobs += 1
+            else:
+                self.active += 1
+        self.local.project = project
+        try:
+            yield
+        finally:
+            self.local.project = None
+            with self.condition:
+                if job:
+                    self.jobs -= 1
+                else:
+                    self.active -= 1
+                self.condition.notify_all()
+
+    def enter(self, project, timeout=None):
+        """Enter ``project`` until ``exit``; for use in request hooks"""
+        manager = self.use(project, timeout)
+        manager.__enter__()
+        self.local.manager = manager
+
+    def exit(self):
+        manager = getattr(self.local, "manager", None)
+        if manager is not None:
+            self.local.manager = None
+            manager.__exit__(None, None, None)
+
+    def reload(self, project):
+        """Read the metadata of ``project`` again, after a job process changed it"""
+        with self.condition:
+            # Other projects read their metadata when switched to
+            if projects.current == project:
+                for store in config.metadata:
+                    store.load()
+
+    def wrap(self, project, func):
+        """``func``, but run in ``project``; used for jobs"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.use(project, job=True):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+gate = ProjectGate()
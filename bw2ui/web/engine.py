@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from bw2data import JsonWrapper, preferences, projects
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+import logging
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("bw2ui.web")
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class StatusStore(object):
+    """In-memory store of job status dictionaries, optionally persisted to SQLite.
+
+With ``shared``, SQLite is the source of truth for several worker processes."""
+
+    poll_interval = 0.1
+
+    def __init__(self, filepath=None, shared=False):
+        if shared and not filepath:
+            raise ValueError("A shared status store needs a database file")
+        self.filepath = filepath
+        self.shared = shared
+        self.data = {}
+        self.updated = {}
+        self.versions = {}
+        self.cancelled = set()
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self._connection = self._pid = None
+
+    @property
+    def connection(self):
+        """SQLite connection, opened lazily in each process"""
+        if not self.filepath:
+            return None
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                self.filepath, timeout=30, check_same_thread=False)
+            if self.shared:
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS status "
+                "(job TEXT PRIMARY KEY, data TEXT, updated REAL)"
+            )
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def set(self, job, status):
+        with self.lock:
+            self.data[job] = status
+            self.updated[job] = time.time()
+            self.versions[job] = self.versions.get(job, 0) + 1
+            self.changed.notify_all()
+            if self.connection is not None:
+                self.connection.execute(
+                    "REPLACE INTO status VALUES (?, ?, ?)",
+                    (job, JsonWrapper.dumps(status), self.updated[job])
+                )
+                self.connection.commit()
+
+    def update(self, job, **kwargs):
+        with self.lock:
+            status = dict(self.get(job))
+            status.update(kwargs)
+            self.set(job, status)
+
+    def _read(self, job):
+        row = self.connection.execute(
+            "SELECT data, updated FROM status WHERE job = ?", (job,)
+        ).fetchone()
+        if not row:
+            raise KeyError(job)
+        self.data[job] = JsonWrapper.loads(row[0])
+        self.updated[job] = row[1]
+        return row[1], self.data[job]
+
+    def get(self, job):
+        with self.lock:
+            if job in self.data and not self.shared:
+                return self.data[job]
+            if self.connection is not None:
+                return self._read(job)[1]
+            raise KeyError(job)
+
+    def wait(self, job, version, timeout=None):
+        """Wait for a status newer than ``version``; returns ``(version, status)``"""
+        if self.shared:
+            deadline = None if timeout is None else time.time() + timeout
+            while True:
+                with self.lock:
+                    current = self._read(job)
+                if current[0] != version or (deadline and time.time() >= deadline):
+                    return current
+                time.sleep(self.poll_interval)
+        with self.changed:
+            self.changed.wait_for(
+                lambda: self.versions.get(job, 0) != version, timeout
+            )
+            return self.versions.get(job, 0), self.get(job)
+
+    def cancel(self, job):
+        with self.lock:
+            self.cancelled.add(job)
+        if self.shared:
+            self.set(job + ":cancelled", {"cancelled": True})
+
+    def is_cancelled(self, job):
+        if job in self.cancelled:
+            return True
+        if self.shared:
+            try:
+                self.get(job + ":cancelled")
+            except KeyError:
+                return False
+            self.cancelled.add(job)
+            return True
+        return False
+
+    def touch(self, job):
+        """Mark ``job`` as updated now, so that ``expire`` keeps it"""
+        with self.lock:
+            if job in self.updated:
+                self.updated[job] = time.time()
+            if self.connection is not None:
+                self.connection.execute(
+                    "UPDATE status SET updated = ? WHERE job = ?", (time.time(), job)
+                )
+                self.connection.commit()
+
+    def delete(self, job):
+        with self.lock:
+            self.data.pop(job, None)
+            self.updated.pop(job, None)
+            self.versions.pop(job, None)
+            self.cancelled.discard(job)
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM status WHERE job = ?", (job,))
+                self.connection.commit()
+
+    def expire(self, ttl, keep=()):
+        """Delete entries not updated in ``ttl`` seconds, except those in ``keep``"""
+        cutoff = time.time() - ttl
+        with self.lock:
+            for job in [k for k, v in self.updated.items() if v < cutoff]:
+                if job not in keep:
+                    self.delete(job)
+            self.cancelled.intersection_update(self.data)
+            if self.connection is not None:
+                keep = list(keep)
+                self.connection.execute(
+                    "DELETE FROM status WHERE updated < ? AND job NOT IN (%s)"
+                    % ", ".join("?" * len(keep)), [cutoff] + keep
+                )
+                self.connection.commit()
+
+
+class JobEngine(object):
+    """Run jobs in a bounded thread pool, tracking their state in a ``StatusStore``.
+
+``set_status`` raises ``JobCancelled`` once a job has been cancelled. Records of
+finished jobs are removed after ``ttl`` seconds."""
+
+    def __init__(self, store, workers=4, queue_size=32, ttl=3600):
+        self.store = store
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.futures = {}
+        self.linked = {}
+        self.touched = {}
+        self.lock = threading.RLock()
+        self.last_cleanup = time.time()
+        self._processes = self._process_workers = None
+        self._process_users = {}
+        self.forward = None
+
+    def submit(self, job, func, *args, **kwargs):
+        if not self.slots.acquire(False):
+            raise QueueFull
+        self.cleanup()
+        try:
+            with self.lock:
+                status = self.store.get(job).get("status")
+                if status:
+                    self.linked[job] = status
+                self.store.update(job, state="queued")
+                future = self.executor.submit(self._run, job, func, *args, **kwargs)
+                self.futures[job] = future
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self._done(job))
+        return future
+
+    def _run(self, job, func, *args, **kwargs):
+        self.store.update(job, state="running")
+        try:
+            result = func(*args, **kwargs)
+        except JobCancelled:
+            self._finish(job, "cancelled", {"cancelled": True})
+        except Exception as e:
+            logger.exception("Job %s failed", job)
+            self._finish(job, "error", {"error": str(e)})
+        else:
+            self.store.update(job, state="finished")
+            return result
+
+    def _finish(self, job, state, extra):
+        self.store.update(job, state=state)
+        status = self.linked.get(job)
+        if status:
+            data = {"status": state, "finished": True}
+            data.update(extra)
+            self.store.set(status, data)
+
+    def _done(self, job):
+        with self.lock:
+            self.futures.pop(job, None)
+            self.touched.pop(job, None)
+        self.slots.release()
+
+    def set_status(self, job, status):
+        if self.forward is not None:
+            # In a job process; see ``run_in_process``
+            messages, cancelled = self.forward
+            if cancelled.is_set():
+                raise JobCancelled
+            messages.put(("status", job, status))
+            return
+        if self.store.is_cancelled(job):
+            raise JobCancelled
+        self.store.set(job, status)
+        now = time.time()
+        with self.lock:
+            owners = [key for key, value in self.linked.items()
+                      if value == job and key in self.futures
+                      and now - self.touched.get(key, 0) > 60]
+            self.touched.update((owner, now) for owner in owners)
+        for owner in owners:
+            # Job records are written once; other worker processes expire them
+            # by age, as they don't know which jobs run here
+            self.store.touch(owner)
+
+    def get_status(self, job):
+        return self.store.get(job)
+
+    def cancel(self, job):
+        """Cancel ``job``; running jobs stop at their next status update"""
+        self.store.cancel(job)
+        status = self.linked.get(job) or self.store.get(job).get("status")
+        if status:
+            self.store.cancel(status)
+        with self.lock:
+            future = self.futures.get(job)
+        if future is not None and future.cancel():
+            self._finish(job, "cancelled", {"cancelled": True})
+        return future is not None
+
+    def is_cancelled(self, job):
+        return self.store.is_cancelled(job)
+
+    def running(self):
+        with self.lock:
+            return set(self.futures).union(
+                self.linked[job] for job in self.futures if job in self.linked
+            )
+
+    def cleanup(self, force=False):
+        """Remove records of finished jobs older than ``ttl``, at most once a minute"""
+        if not force and time.time() - self.last_cleanup < 60:
+            return
+        self.last_cleanup = time.time()
+        keep = self.running()
+        self.store.expire(self.ttl, keep)
+        with self.lock:
+            self.linked = {
+                k: v for k, v in self.linked.items() if k in self.store.data
+            }
+
+    @contextmanager
+    def processes(self, workers=None):
+        """Shared process pool for jobs, as a context manager.
+
+A new pool is made when ``workers`` changes; the old one is shut down once unused."""
+        with self.lock:
+            if self._processes is None or self._process_workers != workers:
+                old = self._processes
+                self._processes = ProcessPoolExecutor(max_workers=workers)
+                self._process_workers = workers
+                if old is not None and not self._process_users.get(old):
+                    self._process_users.pop(old, None)
+                    old.shutdown(wait=False)
+            pool = self._processes
+            self._process_users[pool] = self._process_users.get(pool, 0) + 1
+        try:
+            yield pool
+        finally:
+            with self.lock:
+                self._process_users[pool] -= 1
+                if not self._process_users[pool] and pool is not self._processes:
+                    del self._process_users[pool]
+                    pool.shutdown(wait=False)
+
+    def run_in_process(self, project, job, kwargs):
+        """Run ``job`` with the arguments ``kwargs`` in a new process using ``project``.
+
+Status updates of the process are set here. After a cancel, the process stops at its
+next status update, or is terminated after ``web job cancel wait`` seconds."""
+        cancel_wait = preferences.get("web job cancel wait", 30)
+        context = multiprocessing.get_context("spawn")
+        messages, cancelled = context.Queue(), context.Event()
+        process = context.Process(
+            target=process_job, name="bw2web-%s" % kwargs.get("name"),
+            args=(project, job, kwargs, messages, cancelled))
+        process.start()
+        deadline = None
+        try:
+            while True:
+                if deadline is None and self.store.is_cancelled(job):
+                    cancelled.set()
+                    deadline = time.time() + cancel_wait
+                if deadline is not None and time.time() > deadline:
+                    raise JobCancelled
+                try:
+                    message = messages.get(timeout=1)
+                except queue.Empty:
+                    if not process.is_alive():
+                        raise RuntimeError(
+                            "Job process exited with code %s" % process.exitcode)
+                    continue
+                if message[0] == "status" and deadline is None:
+                    try:
+                        self.set_status(message[1], message[2])
+                    except JobCancelled:
+                        cancelled.set()
+                        deadline = time.time() + cancel_wait
+                elif message[0] == "result":
+                    return message[1]
+                elif message[0] == "error":
+                    raise RuntimeError(message[1])
+                elif message[0] == "cancelled":
+                    raise JobCancelled
+        finally:
+            if deadline is None or time.time() <= deadline:
+                process.join(5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def share(self):
+        """Keep job status in a SQLite database shared with other worker processes"""
+        self.store = StatusStore(
+            os.path.join(projects.request_directory("jobs"), "jobs.sqlite"),
+            shared=True
+        )
+
+
+def process_job(project, job, kwargs, messages, cancelled):
+    """Entry point of the processes of ``JobEngine.run_in_process``"""
+    from .jobs import JobDispatch
+    projects.set_current(project)
+    engine.forward = (messages, cancelled)
+    try:
+        result = JobDispatch()(job, **kwargs)
+    except JobCancelled:
+        messages.put(("cancelled",))
+    except Exception as e:
+        logger.exception("Job %s failed", job)
+        messages.put(("error", str(e)))
+    else:
+        messages.put(("result", result))
+
+
+def create_engine():
+    filepath = None
+    if preferences.get("web jobs persist", False):
+        filepath = os.path.join(projects.request_directory("jobs"), "jobs.sqlite")
+    return JobEngine(
+        StatusStore(filepath),
+        workers=preferences.get("web job workers", 4),
+        queue_size=preferences.get("web job queue", 32),
+        ttl=preferences.get("web job ttl", 3600),
+    )
+
+
+engine = create_engine()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from collections import OrderedDict
+import itertools
+import os
+import threading
+import time
+import uuid
+
+
+class DirectoryLister(object):
+    """Paginated directory listings for the file picker, read with ``os.scandir``.
+
+Open listings are kept for ``ttl`` seconds, so the next page continues where the last
+one stopped."""
+
+    def __init__(self, ttl=30, max_open=32, max_cached=200000):
+        self.ttl = ttl
+        self.max_open = max_open
+        self.max_cached = max_cached
+        self.lock = threading.Lock()
+        self.listings = OrderedDict()
+        self.directories = {}
+
+    def is_dir(self, path, entry=None):
+        now = time.time()
+        with self.lock:
+            cached = self.directories.get(path)
+        if cached and cached[0] > now:
+            return cached[1]
+        try:
+            value = entry.is_dir() if entry is not None else os.path.isdir(path)
+        except OSError:
+            value = False
+        with self.lock:
+            if len(self.directories) >= self.max_cached:
+                self.directories = {
+                    k: v for k, v in self.directories.items() if v[0] > now
+                }
+            self.directories[path] = (now + self.ttl, value)
+        return value
+
+    def resume(self, path, cursor):
+        """``(token, iterator, offset)`` to continue reading ``path`` at ``cursor``"""
+        token, offset = None, 0
+        if cursor:
+            token, _, offset = cursor.rpartition("-")
+            offset = int(offset)
+            with self.lock:
+                listing = self.listings.pop(token, None)
+            if listing is not None:
+                if listing[1:3] == (path, offset):
+                    return token, listing[3], offset
+                listing[3].close()
+        iterator = os.scandir(path)
+        # Skip what previous pages have already shown
+        next(itertools.islice(iterator, offset, offset), None)
+        return token or uuid.uuid4().hex, iterator, offset
+
+    def keep(self, token, path, offset, iterator):
+        now = time.time()
+        closing = []
+        with self.lock:
+            self.listings[token] = (now + self.ttl, path, offset, iterator)
+            # Oldest first; they also expire first
+            for key in list(self.listings):
+                if self.listings[key][0] <= now or len(self.listings) > self.max_open:
+                    closing.append(self.listings.pop(key))
+        for listing in closing:
+            listing[3].close()
+
+    def listing(self, path, cursor=None, limit=100):
+        """Up to ``limit`` entries of ``path`` after ``cursor``, and the next cursor.
+
+Each page is sorted, but pages come in ``os.scandir`` order. The cursor is ``None`` at
+the end; raises ``ValueError`` for invalid cursors."""
+        if not self.is_dir(path):
+            return [], None
+        try:
+            token, iterator, offset = self.resume(path, cursor)
+        except OSError:
+            # No permission or other OS error
+            return [], None
+        entries = []
+        try:
+            for entry in iterator:
+                offset += 1
+                if entry.name.startswith("."):
+                    continue
+                data = {
+                    "dir": self.is_dir(entry.path, entry),
+                    "name": entry.name,
+                    "path": entry.path,
+                }
+                if not data["dir"]:
+                    data["ext"] = entry.name.split(".")[-1].lower()
+                entries.append(data)
+                if len(entries) >= limit:
+                    break
+            else:
+                iterator.close()
+                iterator = None
+        except OSError:
+            iterator.close()
+            iterator = None
+        entries.sort(key=lambda x: (not x["dir"], x["name"].lower()))
+        if iterator is None:
+            return entries, None
+        self.keep(token, path, offset, iterator)
+        return entries, "%s-%s" % (token, offset)
+
+
+lister = DirectoryLister()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from ..uncertainty import database_params, summarize
+from .cache import dependency_version
+from .indexes import get_flows
+from bw2analyzer import DatabaseHealthCheck
+from bw2data import JsonWrapper, preferences, projects
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+
+RESULT_FILENAME = "result.json"
+
+# Change when the stored result changes, so that older results are recalculated
+RESULT_FORMAT = 3
+
+
+def health_check_run(database):
+    """Output directory of the health check of the current version of ``database``"""
+    version = hashlib.sha1(
+        repr((RESULT_FORMAT, database, dependency_version(database))).encode("utf-8")
+    ).hexdigest()[:16]
+    name = "".join(c if c.isalnum() else "_" for c in database)[:40]
+    # The readable part isn't unique, e.g. for "my db" and "my_db"
+    digest = hashlib.sha1(database.encode("utf-8")).hexdigest()[:8]
+    return "%s-%s.%s" % (name, digest, version)
+
+
+def health_check_directory(run=None):
+    directory = projects.request_directory("health-check")
+    return os.path.join(directory, run) if run else directory
+
+
+def health_check_result(database):
+    """Stored health check result of the current version of ``database``, or ``None``"""
+    run = health_check_run(database)
+    filepath = os.path.join(health_check_directory(run), RESULT_FILENAME)
+    try:
+        with io.open(filepath, encoding="utf-8") as f:
+            result = JsonWrapper.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return None
+    result["run"] = run
+    return result
+
+
+class HealthCheck(DatabaseHealthCheck):
+    """``DatabaseHealthCheck`` which loads the database once and uses a thread pool"""
+
+    def __init__(self, database):
+        super(HealthCheck, self).__init__(database)
+        self.lock = threading.Lock()
+        self.data = None
+        self.db.load = self.load
+
+    def load(self, *args, **kwargs):
+        with self.lock:
+            if self.data is None:
+                self.data = type(self.db).load(self.db, *args, **kwargs)
+            return self.data
+
+    def uncertainty_check(self):
+        """Summary per uncertainty type, see ``uncertainty.summarize``"""
+        return summarize(database_params(self.db.name))
+
+    def ouroboros(self):
+        """Keys of processes which consume their own reference product as an input"""
+        return [
+            key for key, value in self.load().items()
+            if any(
+                exc.get("type") == "technosphere"
+                and tuple(exc.get("input") or ()) == key
+                for exc in value.get("exchanges", [])
+            )
+        ]
+
+    def check(self, graphs_dir=None, progress=None, threads=None):
+        tasks = {
+            "graphs": lambda: self.make_graphs(graphs_dir),
+            "pr": self.page_rank,
+            "ue": self.unique_exchanges,
+            "uncertainty": self.uncertainty_check,
+            "aggregated": self.aggregated_processes,
+            "nsp": self.no_self_production,
+            "mo": self.multioutput_processes,
+            "ob": self.ouroboros,
+        }
+        results = {}
+        executor = ThreadPoolExecutor(
+            threads or preferences.get("web health check threads", 4))
+        try:
+            futures = {executor.submit(func): name for name, func in tasks.items()}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if progress:
+                    progress(futures[future], len(results), len(tasks))
+        finally:
+            executor.shutdown(wait=True)
+        _, results["tfn"], _, results["bfn"] = results.pop("graphs")
+        aggregated = results.pop("aggregated")
+        results["sp"] = aggregated["system_processes"]
+        results["me"] = aggregated["many_exchanges"]
+        return results
+
+
+def as_rows(keys_and_scores, data):
+    """Table rows for ``(key, score)`` pairs; ``score`` can be ``None``"""
+    rows = []
+    for key, score in keys_and_scores:
+        if isinstance(key, int):
+            ds = data.get(key, {})
+            key = (ds.get('database'), ds.get('code'))
+        else:
+            ds = data.get(tuple(key), {})
+        rows.append({
+            'name': ds.get('name', "Unknown"),
+            'categories': ",".join(ds.get('categories', [])),
+            'location': ds.get('location', ''),
+            'unit': ds.get('unit', ''),
+            'key': list(key),
+            'score': score,
+        })
+    return rows
+
+
+def run_health_check(database, progress=None):
+    """Run the health check for ``database`` and store its result; returns the run"""
+    run = health_check_run(database)
+    directory = health_check_directory(run)
+    if os.path.exists(os.path.join(directory, RESULT_FILENAME)):
+        return run
+    working = tempfile.mkdtemp(prefix=run + ".", dir=health_check_directory())
+    try:
+        check = HealthCheck(database)
+        dhc = check.check(working, progress)
+        number = len(check.load())
+        pr = [(key, score * number) for score, key in dhc['pr'][:20]]
+        keys = [key for key, _ in pr] + list(dhc['nsp']) + list(dhc['ob'])
+        for obj in ('mo', 'me', 'sp'):
+            keys.extend(key for key, _ in dhc[obj])
+        data = get_flows(key if isinstance(key, int) else tuple(key) for key in keys)
+        result = {
+            'tfn': dhc['tfn'],
+            'bfn': dhc['bfn'],
+            'ue': list(dhc['ue']),
+            'pr': as_rows(pr, data),
+            'uncertainty': dhc['uncertainty'],
+            'nsp': as_rows(((key, None) for key in dhc['nsp']), data),
+            'ob': as_rows(((key, None) for key in dhc['ob']), data),
+        }
+        for obj in ('mo', 'me', 'sp'):
+            result[obj] = as_rows(dhc[obj], data)
+        filepath = os.path.join(working, RESULT_FILENAME)
+        with io.open(filepath, "w", encoding="utf-8") as f:
+            f.write(JsonWrapper.dumps(result))
+        try:
+            os.rename(working, directory)
+        except OSError:
+            # Another run finished first
+            shutil.rmtree(working, ignore_errors=True)
+    except:
+        shutil.rmtree(working, ignore_errors=True)
+        raise
+    remove_old_runs(run)
+    return run
+
+
+def remove_old_runs(run):
+    """Remove finished runs for earlier versions of the same database"""
+    prefix = run.rsplit(".", 1)[0] + "."
+    for name in os.listdir(health_check_directory()):
+        other = health_check_directory(name)
+        # Working directories of unfinished runs have another dot and suffix
+        if (name != run and name.startswith(prefix) and "." not in name[len(prefix):]
+                and os.path.exists(os.path.join(other, RESULT_FILENAME))):
+            shutil.rmtree(other, ignore_errors=True)
@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from .indexes import ActivityDataset, ExchangeDataset, FlowIndex, biosphere_index, \
+    chunked, flow_key
+from bw2data import Database, Method, config, databases, geomapping, methods, \
+    preferences
+from bw2io.compatibility import ECOSPOLD_2_3_BIOSPHERE
+from bw2io.migrations import Migration, migrations
+from bw2io.units import normalize_units
+from collections import Counter
+import csv
+from stats_arrays import LognormalUncertainty, NormalUncertainty, \
+    TriangularUncertainty, UndefinedUncertainty, UniformUncertainty
+import hashlib
+import io
+import math
+import os
+import time
+import xml.etree.ElementTree as ElementTree
+
+try:
+    from bw2data.snowflake_ids import snowflake_id_generator
+except ImportError:
+    # Before bw2data 4, ids are assigned by SQLite
+    snowflake_id_generator = None
+
+# Rows per INSERT statement; older SQLite versions allow 999 variables per query
+INSERT_SIZE = 100
+
+# (group element, group number) to exchange type. Byproducts (output group 2)
+# and waste to treatment (3) need allocation, and are skipped.
+EXCHANGE_TYPES = {
+    ("inputGroup", "1"): "technosphere",
+    ("inputGroup", "2"): "technosphere",
+    ("inputGroup", "3"): "technosphere",
+    ("inputGroup", "4"): "biosphere",
+    ("inputGroup", "5"): "technosphere",
+    ("outputGroup", "0"): "production",
+    ("outputGroup", "1"): "substitution",
+    ("outputGroup", "4"): "biosphere",
+}
+
+
+def local_name(tag):
+    """Tag without the XML namespace"""
+    return tag.rpartition("}")[2]
+
+
+def ecospold_files(path):
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(".xml")
+        )
+    return [path] if os.path.isfile(path) else []
+
+
+def parse_exchange(element):
+    data = dict(element.attrib)
+    for child in element:
+        tag = local_name(child.tag)
+        if tag in ("inputGroup", "outputGroup"):
+            data["group"] = (tag, (child.text or "").strip())
+    return data
+
+
+def iter_datasets(filepath):
+    """``(reference function, location, exchanges)`` of each dataset of a file.
+
+The file is parsed incrementally, and datasets are dropped from the tree once read."""
+    reference, location, exchanges = {}, None, []
+    root = None
+    for event, element in ElementTree.iterparse(filepath, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            continue
+        tag = local_name(element.tag)
+        if tag == "referenceFunction":
+            reference = dict(element.attrib)
+        elif tag == "geography":
+            location = element.get("location")
+        elif tag == "exchange":
+            exchanges.append(parse_exchange(element))
+        elif tag == "dataset":
+            yield reference, location, exchanges
+            reference, location, exchanges = {}, None, []
+            element.clear()
+            # Datasets are children of the root, which would keep the cleared elements
+            root.clear()
+
+
+def read_datasets(files):
+    """Datasets of all ``files`` as ``(filepath, bytes read in all files, dataset)``"""
+    done = 0
+    for filepath in files:
+        with io.open(filepath, "rb") as f:
+            for dataset in iter_datasets(f):
+                yield filepath, done + f.tell(), dataset
+        done += os.path.getsize(filepath)
+
+
+def files_size(files):
+    return sum(os.path.getsize(filepath) for filepath in files)
+
+
+def ecospold_categories(category, subcategory):
+    return tuple(
+        c for c in (category, subcategory)
+        if c and c.strip().lower() != "unspecified"
+    )
+
+
+def activity_code(name, unit, location):
+    """Code of a dataset, from the fields which technosphere exchanges refer to it by"""
+    string = "".join((name or "", unit or "", location or "")).lower()
+    return hashlib.md5(string.encode("utf-8")).hexdigest()
+
+
+def uncertainty(exchange, amount):
+    """Uncertainty fields in the ``stats_arrays`` format for an ecospold 1 exchange"""
+    kind = exchange.get("uncertaintyType")
+    sd95 = float(exchange.get("standardDeviation95") or 0)
+    minimum = float(exchange.get("minValue") or 0)
+    maximum = float(exchange.get("maxValue") or 0)
+    if kind == "1" and amount and sd95 > 1:
+        return {
+            "uncertainty type": LognormalUncertainty.id,
+            "loc": math.log(abs(amount)),
+            "scale": math.log(math.sqrt(sd95)),
+            "negative": amount < 0,
+        }
+    elif kind == "2" and sd95 > 0:
+        return {
+            "uncertainty type": NormalUncertainty.id, "loc": amount, "scale": sd95 / 2
+        }
+    elif kind == "3" and minimum < maximum:
+        return {
+            "uncertainty type": TriangularUncertainty.id,
+            "loc": float(exchange.get("mostLikelyValue") or amount),
+            "minimum": minimum,
+            "maximum": maximum,
+        }
+    elif kind == "4" and minimum < maximum:
+        return {
+            "uncertainty type": UniformUncertainty.id,
+            "loc": amount,
+            "minimum": minimum,
+            "maximum": maximum,
+        }
+    return {"uncertainty type": UndefinedUncertainty.id, "loc": amount}
+
+
+def biosphere_name_migration():
+    """Dictionary from ``flow_key`` to ecoinvent 3 flow names, from ``bw2io``"""
+    if "biosphere-2-3-names" not in migrations:
+        return {}
+    return {
+        flow_key(name, categories, unit): new["name"]
+        for (name, categories, unit, _), new in
+        Migration("biosphere-2-3-names").load()["data"]
+        if "name" in new
+    }
+
+
+def ecospold_flow_key(exchange, names):
+    """``flow_key`` of an ecospold 1 biosphere exchange, renamed to ecoinvent 3"""
+    categories = ecospold_categories(
+        exchange.get("category"), exchange.get("subCategory"))
+    categories = ECOSPOLD_2_3_BIOSPHERE.get(categories, categories)
+    key = flow_key(exchange.get("name"), categories, exchange.get("unit"))
+    if key in names:
+        key = (names[key].lower(),) + key[1:]
+    return key
+
+
+def biosphere_flows():
+    return biosphere_index() if config.biosphere in databases else FlowIndex(())
+
+
+class Ecospold1Import(object):
+    """Import an ecospold 1 file, or a directory of them, as the new database ``name``.
+
+Datasets are written with bulk inserts, ``web import chunk`` exchanges per transaction.
+If the import fails, everything written so far is deleted."""
+
+    def __init__(self, path, name, progress=None):
+        self.path = path
+        self.name = name
+        self.progress = progress or (lambda status: None)
+        self.chunk_size = preferences.get("web import chunk", 10000)
+        self.biosphere = biosphere_flows()
+        self.names = biosphere_name_migration()
+        self.activities, self.exchanges = [], []
+        self.codes, self.inputs = set(), {}
+        self.locations = set()
+        self.skipped = Counter()
+        self.unlinked = Counter()
+        self.number = self.written = 0
+
+    def add(self, reference, location, exchanges):
+        name, unit = reference.get("name"), normalize_units(reference.get("unit"))
+        code = activity_code(name, unit, location)
+        if not name or code in self.codes:
+            self.skipped["duplicate or unnamed datasets"] += 1
+            return
+        self.codes.add(code)
+        self.locations.add(location)
+        key = (self.name, code)
+        row = {
+            "data": {
+                "name": name,
+                "categories": ecospold_categories(
+                    reference.get("category"), reference.get("subCategory")),
+                "unit": unit,
+                "location": location,
+                "comment": reference.get("generalComment", ""),
+                "reference product": name,
+                "type": "process",
+                "database": self.name,
+                "code": code,
+            },
+            "code": code,
+            "database": self.name,
+            "location": location,
+            "name": name,
+            "product": name,
+            "type": "process",
+        }
+        if snowflake_id_generator is not None:
+            row["id"] = next(snowflake_id_generator)
+        self.activities.append(row)
+        production = False
+        for exchange in exchanges:
+            kind = EXCHANGE_TYPES.get(exchange.get("group"))
+            if kind == "production":
+                if production:
+                    kind = None
+                production = True
+            if kind is None:
+                self.skipped["byproducts and waste to treatment"] += 1
+                continue
+            if kind == "production":
+                input_key = key
+            elif kind == "biosphere":
+                input_code = self.biosphere.match(
+                    ecospold_flow_key(exchange, self.names), exchange.get("CASNumber"))
+                if input_code is None:
+                    self.unlinked[(exchange.get("name"), "biosphere")] += 1
+                    continue
+                input_key = (config.biosphere, input_code)
+            else:
+                input_code = activity_code(
+                    exchange.get("name"), normalize_units(exchange.get("unit")),
+                    exchange.get("location"))
+                self.inputs.setdefault(input_code, exchange.get("name"))
+                input_key = (self.name, input_code)
+            amount = float(exchange.get("meanValue") or 0)
+            data = {
+                "input": input_key,
+                "output": key,
+                "amount": amount,
+                "type": kind,
+                "name": exchange.get("name"),
+                "unit": normalize_units(exchange.get("unit")),
+            }
+            data.update(uncertainty(exchange, amount))
+            self.exchanges.append({
+                "data": data,
+                "input_database": input_key[0],
+                "input_code": input_key[1],
+                "output_database": key[0],
+                "output_code": key[1],
+                "type": kind,
+            })
+        self.number += 1
+
+    def flush(self):
+        with ActivityDataset._meta.database.atomic():
+            for rows in chunked(self.activities, INSERT_SIZE):
+                ActivityDataset.insert_many(rows).execute()
+            for rows in chunked(self.exchanges, INSERT_SIZE):
+                ExchangeDataset.insert_many(rows).execute()
+        self.written += len(self.exchanges)
+        self.activities, self.exchanges = [], []
+
+    def delete_unlinked(self):
+        """Delete technosphere exchanges whose input isn't in the imported datasets"""
+        for code in set(self.inputs).difference(self.codes):
+            self.unlinked[(self.inputs[code], "technosphere")] += 1
+        own = ActivityDataset.select(ActivityDataset.code).where(
+            ActivityDataset.database == self.name)
+        return ExchangeDataset.delete().where(
+            (ExchangeDataset.output_database == self.name)
+            & (ExchangeDataset.input_database == self.name)
+            & ~(ExchangeDataset.input_code << own)
+        ).execute()
+
+    def delete(self):
+        ExchangeDataset.delete().where(
+            ExchangeDataset.output_database == self.name).execute()
+        ActivityDataset.delete().where(
+            ActivityDataset.database == self.name).execute()
+        if self.name in databases:
+            del databases[self.name]
+
+    def finish(self):
+        """Update metadata, processed arrays and the search index of the database"""
+        databases[self.name]["number"] = self.number
+        databases.set_modified(self.name)
+        geomapping.add({location for location in self.locations if location})
+        database = Database(self.name)
+        database.process()
+        database.make_searchable(reset=True)
+
+    def status(self, message, read, size):
+        return {
+            "status": message,
+            "read": read,
+            "size": size,
+            "datasets": self.number,
+            "exchanges": self.written + len(self.exchanges),
+        }
+
+    def run(self):
+        if self.name in databases:
+            raise ValueError("Database %s already exists" % self.name)
+        files = ecospold_files(self.path)
+        if not files:
+            raise ValueError("No XML files found at %s" % self.path)
+        Database(self.name).register(format="Ecospold1", filepath=self.path)
+        size = files_size(files)
+        try:
+            last_update = 0
+            for _, read, dataset in read_datasets(files):
+                self.add(*dataset)
+                if len(self.exchanges) >= self.chunk_size:
+                    self.flush()
+                if time.time() - last_update > 0.5:
+                    self.progress(self.status("Importing", read, size))
+                    last_update = time.time()
+            self.flush()
+            self.progress(self.status("Linking", size, size))
+            self.written -= self.delete_unlinked()
+            self.progress(self.status("Building indexes", size, size))
+            self.finish()
+        except:
+            self.delete()
+            raise
+        result = self.status("finished", size, size)
+        result.update(
+            database=self.name,
+            skipped=dict(self.skipped),
+            unlinked=[
+                {"name": name, "type": kind, "count": count}
+                for (name, kind), count in self.unlinked.most_common(50)
+            ],
+        )
+        return result
+
+
+class MethodImport(object):
+    """Import the LCIA methods of an ecospold 1 file, or of a directory of them"""
+
+    fields = (
+        "method", "name", "category", "subcategory", "unit", "CAS number", "amount"
+    )
+
+    def __init__(self, path, progress=None, unmatched=None):
+        self.path = path
+        self.progress = progress or (lambda status: None)
+        self.unmatched = unmatched
+        self.flows = biosphere_flows()
+        self.names = biosphere_name_migration()
+        self.imported, self.skipped = [], []
+        self.number = self.missing = 0
+
+    def method_name(self, reference):
+        return tuple(
+            value for value in (
+                reference.get("category"), reference.get("subCategory"),
+                reference.get("name"))
+            if value
+        )
+
+    def characterization_factors(self, name, exchanges, writer):
+        explicit, implicit = {}, {}
+        for exchange in exchanges:
+            amount = float(exchange.get("meanValue") or 0)
+            key = ecospold_flow_key(exchange, self.names)
+            code = self.flows.match(key, exchange.get("CASNumber"))
+            subcategories = self.flows.subcategories(key)
+            if code is not None:
+                explicit[code] = amount
+            elif not subcategories:
+                self.missing += 1
+                if writer is not None:
+                    writer.writerow([
+                        " - ".join(name), exchange.get("name"),
+                        exchange.get("category"), exchange.get("subCategory"),
+                        exchange.get("unit"),
+                        exchange.get("CASNumber"), amount,
+                    ])
+            for other in subcategories:
+                implicit.setdefault(other, amount)
+        implicit.update(explicit)
+        return [[(config.biosphere, code), amount] for code, amount in implicit.items()]
+
+    def add(self, filepath, reference, exchanges, writer):
+        name = self.method_name(reference)
+        if not name or name in methods:
+            self.skipped.append(name)
+            return
+        cfs = self.characterization_factors(name, exchanges, writer)
+        method = Method(name)
+        method.register(
+            unit=normalize_units(reference.get("unit") or ""),
+            description=reference.get("generalComment") or "",
+            filename=os.path.basename(filepath),
+        )
+        # Registered first, so ``delete`` also removes a method whose write fails
+        self.imported.append(name)
+        # Writing also processes the method arrays
+        method.write(cfs)
+        self.number += len(cfs)
+
+    def delete(self):
+        for name in self.imported:
+            if name in methods:
+                Method(name).deregister()
+
+    def status(self, message, read, size):
+        return {
+            "status": message,
+            "read": read,
+            "size": size,
+            "methods": len(self.imported),
+            "cfs": self.number,
+            "unmatched": self.missing,
+        }
+
+    def run(self):
+        files = ecospold_files(self.path)
+        if not files:
+            raise ValueError("No XML files found at %s" % self.path)
+        f = writer = None
+        if self.unmatched:
+            f = io.open(self.unmatched, "w", newline="", encoding="utf-8")
+            writer = csv.writer(f)
+            writer.writerow(self.fields)
+        size = files_size(files)
+        try:
+            last_update = 0
+            for filepath, read, (reference, _, exchanges) in read_datasets(files):
+                self.add(filepath, reference, exchanges, writer)
+                if time.time() - last_update > 0.5:
+                    self.progress(self.status("Importing", read, size))
+                    last_update = time.time()
+        except:
+            self.delete()
+            raise
+        finally:
+            if f is not None:
+                f.close()
+        result = self.status("finished", size, size)
+        result["skipped"] = [" - ".join(name) for name in self.skipped]
+        return result
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from .cache import cache, database_version, inventory_version, method_version
+from bisect import bisect_left
+from bw2data import Method, config, databases, methods, preferences
+from bw2io.units import normalize_units
+from collections import deque
+from genson import SchemaBuilder
+import heapq
+import re
+
+try:
+    from bw2data.backends import ActivityDataset, ExchangeDataset
+except ImportError:
+    from bw2data.backends.peewee import ActivityDataset, ExchangeDataset
+
+# Stay well below the SQLite limit on the number of query variables
+CHUNK_SIZE = 500
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def chunked(iterable, size=CHUNK_SIZE):
+    iterable = list(iterable)
+    for index in range(0, len(iterable), size):
+        yield iterable[index:index + size]
+
+
+def get_flows(keys):
+    """Data of many activities by key or id, with one query per database"""
+    by_database, ids, result = {}, [], {}
+    for key in keys:
+        if isinstance(key, int):
+            ids.append(key)
+        else:
+            by_database.setdefault(key[0], set()).add(key[1])
+    for database, codes in by_database.items():
+        for chunk in chunked(codes):
+            query = ActivityDataset.select(
+                ActivityDataset.code, ActivityDataset.data
+            ).where(
+                (ActivityDataset.database == database)
+                & (ActivityDataset.code << chunk)
+            )
+            for row in query:
+                result[(database, row.code)] = row.data
+    for chunk in chunked(set(ids)):
+        query = ActivityDataset.select(
+            ActivityDataset.id, ActivityDataset.data
+        ).where(ActivityDataset.id << chunk)
+        for row in query:
+            result[row.id] = row.data
+    return result
+
+
+def activity_ids(keys):
+    """Dictionary from ``(database, code)`` keys or ids to activity ids"""
+    by_database, result = {}, {}
+    for key in keys:
+        if isinstance(key, int):
+            result[key] = key
+        else:
+            by_database.setdefault(key[0], set()).add(key[1])
+    for database, codes in by_database.items():
+        for chunk in chunked(codes):
+            query = ActivityDataset.select(
+                ActivityDataset.code, ActivityDataset.id
+            ).where(
+                (ActivityDataset.database == database)
+                & (ActivityDataset.code << chunk)
+            ).tuples()
+            for code, id_ in query:
+                result[(database, code)] = id_
+    return result
+
+
+###############
+### Methods ###
+###############
+
+
+def method_abbreviations():
+    """Dictionary from method abbreviation to method name"""
+    return cache.get(
+        ("method-abbreviations",),
+        inventory_version(methods),
+        lambda: {
+            value["abbreviation"]: key
+            for key, value in methods.items()
+            if "abbreviation" in value
+        },
+    )
+
+
+def _build_method_cfs(method):
+    cfs = Method(method).load()
+    flows = get_flows(values[0] for values in cfs)
+    rows = []
+    for values in cfs:
+        if len(values) >= 3:
+            key, value, geo = values[:3]
+        else:
+            key, value = values[:2]
+            geo = config.global_location
+        flow = flows.get(key if isinstance(key, int) else tuple(key), {})
+        if not flow and not isinstance(key, int):
+            # Missing flow; its key still gives the page it would be on
+            flow = {'database': key[0], 'code': key[1]}
+        rows.append({
+            'name': flow.get('name', "Unknown"),
+            'unit': flow.get('unit', ''),
+            'categories': ",".join(flow.get('categories', [])),
+            'cf': value['amount'] if isinstance(value, dict) else value,
+            'location': geo,
+            'database': flow.get('database'),
+            'code': flow.get('code'),
+        })
+    rows.sort(key=lambda x: x['name'])
+    return rows
+
+
+def method_cfs(method):
+    """Characterization factors of ``method`` as table rows, sorted by flow name"""
+    return cache.get(
+        ("method-cfs", method),
+        method_version(method),
+        lambda: _build_method_cfs(method),
+    )
+
+
+#################
+### Databases ###
+#################
+
+
+def short_name(name):
+    return " ".join(name.split(" ")[:3])[:25]
+
+
+def short_names(database):
+    """Dictionary from activity code to short activity name"""
+    def build():
+        query = ActivityDataset.select(
+            ActivityDataset.code, ActivityDataset.name
+        ).where(ActivityDataset.database == database).tuples()
+        return {code: short_name(name or "Unknown") for code, name in query}
+
+    return cache.get(("short-names", database), database_version(database), build)
+
+
+def adjacency(database):
+    """Technosphere inputs (``backwards``) and consumers (``forwards``) by key"""
+    def build():
+        backwards, forwards = {}, {}
+        query = ExchangeDataset.select(
+            ExchangeDataset.input_database,
+            ExchangeDataset.input_code,
+            ExchangeDataset.output_code,
+        ).where(
+            (ExchangeDataset.output_database == database)
+            & (ExchangeDataset.type == "technosphere")
+        ).tuples()
+        for input_database, input_code, output_code in query:
+            source, target = (input_database, input_code), (database, output_code)
+            if source == target:
+                continue
+            backwards.setdefault(target, set()).add(source)
+            if input_database == database:
+                forwards.setdefault(source, set()).add(target)
+        return {
+            "backwards": {k: sorted(v) for k, v in backwards.items()},
+            "forwards": {k: sorted(v) for k, v in forwards.items()},
+        }
+
+    return cache.get(("adjacency", database), database_version(database), build)
+
+
+def tree_node(key, direction):
+    node = {
+        "name": short_names(key[0]).get(key[1], "Unknown")
+            if key[0] in databases else "Unknown",
+        "key": list(key),
+    }
+    neighbours = adjacency(key[0])[direction].get(key, []) \
+        if key[0] in databases else []
+    return node, neighbours
+
+
+def activity_tree(key, direction="backwards", depth=1, max_nodes=500):
+    """Nested supply chain tree, ``depth`` levels deep, of at most ``max_nodes`` nodes.
+
+Nodes which aren't expanded, but have neighbours, are marked ``expandable``."""
+    root, neighbours = tree_node(key, direction)
+    count = 1
+    queue = deque([(root, key, neighbours, (), depth)])
+    while queue:
+        node, key, neighbours, path, depth = queue.popleft()
+        if depth <= 0 or key in path or (
+                path and count + len(neighbours) > max_nodes):
+            node["expandable"] = bool(neighbours)
+            continue
+        count += len(neighbours)
+        node["children"] = []
+        for other in neighbours:
+            child, child_neighbours = tree_node(other, direction)
+            node["children"].append(child)
+            queue.append((child, other, child_neighbours, path + (key,), depth - 1))
+    return root
+
+
+class CompletionIndex(object):
+    """Sorted prefix and token indexes over activity names, for autocompletion"""
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda x: x["n"].lower())
+        self.names = [entry["n"].lower() for entry in self.entries]
+        tokens = sorted({
+            (token, index)
+            for index, name in enumerate(self.names)
+            for token in TOKEN_RE.findall(name)
+        })
+        self.tokens = [token for token, _ in tokens]
+        self.token_ids = [index for _, index in tokens]
+
+    @staticmethod
+    def prefix_range(values, prefix):
+        return (
+            bisect_left(values, prefix),
+            bisect_left(values, prefix + "\uffff"),
+        )
+
+    def complete(self, query, limit=20):
+        query = query.strip().lower()
+        if not query:
+            return []
+        lower, upper = self.prefix_range(self.names, query)
+        candidates = set(range(lower, upper))
+        matched = None
+        # Longest words are the most selective
+        for word in sorted(TOKEN_RE.findall(query), key=len, reverse=True):
+            lower, upper = self.prefix_range(self.tokens, word)
+            ids = set(self.token_ids[lower:upper])
+            matched = ids if matched is None else matched & ids
+            if not matched:
+                break
+        candidates.update(matched or ())
+
+        def rank(index):
+            name = self.names[index]
+            return (name != query, not name.startswith(query), len(name), index)
+
+        return [
+            {
+                "label": "%s (%s, %s)" % (entry["n"], entry["u"], entry["l"]),
+                "value": entry,
+            }
+            for entry in (
+                self.entries[index]
+                for index in heapq.nsmallest(limit, candidates, key=rank)
+            )
+        ]
+
+
+def completion_index(database):
+    def build():
+        query = ActivityDataset.select(
+            ActivityDataset.code, ActivityDataset.data
+        ).where(ActivityDataset.database == database).tuples()
+        return CompletionIndex(
+            {
+                "n": data.get("name", "Unknown"),
+                "u": data.get("unit", "Unknown"),
+                "l": data.get("location", "Unknown"),
+                "k": [database, code],
+            } for code, data in query
+        )
+
+    return cache.get(("completion", database), database_version(database), build)
+
+
+def flow_key(name, categories, unit):
+    """Normalized ``(name, categories, unit)`` of a biosphere flow, for matching"""
+    return (
+        (name or "").strip().lower(),
+        tuple(c.strip().lower() for c in categories or () if c and c.strip()),
+        normalize_units((unit or "").strip()).lower(),
+    )
+
+
+def cas_number(value):
+    """CAS number without leading zeros, e.g. ``124-38-9`` for ``000124-38-9``"""
+    return (value or "").strip().lstrip("0")
+
+
+class FlowIndex(object):
+    """Hashed lookup tables for biosphere flows, by ``flow_key`` and by CAS number"""
+
+    def __init__(self, flows):
+        self.by_key, self.by_cas, self.by_category = {}, {}, {}
+        for code, data in flows:
+            key = flow_key(data.get("name"), data.get("categories"), data.get("unit"))
+            self.by_key.setdefault(key, code)
+            cas = cas_number(data.get("CAS number"))
+            if cas:
+                self.by_cas.setdefault((cas,) + key[1:], code)
+            if len(key[1]) > 1:
+                self.by_category.setdefault(
+                    (key[0], key[1][0], key[2]), []).append(code)
+
+    def match(self, key, cas=None):
+        """Code of the flow with ``key``, or else with the CAS number ``cas``"""
+        code = self.by_key.get(key)
+        if code is None and cas_number(cas):
+            code = self.by_cas.get((cas_number(cas),) + key[1:])
+        return code
+
+    def subcategories(self, key):
+        """Codes of the flows like ``key`` in subcategories of its top-level category"""
+        if len(key[1]) != 1:
+            return []
+        return self.by_category.get((key[0], key[1][0], key[2]), [])
+
+
+def biosphere_index(database=None):
+    """``FlowIndex`` of the flows in ``database`` (default ``config.biosphere``)"""
+    database = database or config.biosphere
+
+    def build():
+        return FlowIndex(ActivityDataset.select(
+            ActivityDataset.code, ActivityDataset.data
+        ).where(ActivityDataset.database == database).tuples())
+
+    return cache.get(("biosphere", database), database_version(database), build)
+
+
+###############
+### Schemas ###
+###############
+
+
+def database_schema(database):
+    """JSON schema of the activities in ``database``, merged from a sample of them"""
+    def build():
+        ids = [row[0] for row in ActivityDataset.select(ActivityDataset.id).where(
+            ActivityDataset.database == database).order_by(ActivityDataset.id).tuples()]
+        size = preferences.get("web schema sample", 500)
+        step = max(1, len(ids) // size)
+        builder = SchemaBuilder()
+        for chunk in chunked(ids[::step][:size]):
+            for (data,) in ActivityDataset.select(ActivityDataset.data).where(
+                    ActivityDataset.id << chunk).tuples():
+                builder.add_object(data)
+        return builder.to_schema()
+
+    return cache.get(("schema", database), database_version(database), build)
@@ -2,7 +2,15 @@
 from __future__ import print_function, unicode_literals
 from eight import *
 
-from .utils import get_job, set_job_status
+from .calculations import ProgressLCAReport, batch_scores, monte_carlo_lca
+from .engine import engine
+from .health import run_health_check
+from .importers import Ecospold1Import, MethodImport
+from .scores import calculate_scores
+from .sketches import MonteCarloSummary
+from .utils import set_job_status
+from bw2data import preferences
+import multiprocessing
 import numpy as np
 import time
 
@@ -27,17 +35,38 @@ class InvalidJob(Exception):
     pass
 
 
+JOBS = {}
+# Long jobs, which run in a process of their own; see ``JobEngine.run_in_process``
+PROCESS_JOBS = set()
+
+
+def register_job(name, process=False):
+    """Decorator to make a job function available to ``JobDispatch`` under ``name``"""
+    def decorator(func):
+        JOBS[name] = func
+        if process:
+            PROCESS_JOBS.add(name)
+        return func
+    return decorator
+
+
 class JobDispatch(object):
-    """Super-ghetto asynchronous jobs framework: Return a web page, which then makes another request(s) to start asynchronous jobs."""
-    def __call__(self, job, **kwargs):
-        if kwargs.get("name") == "progress-test":
-            return progress_test(job, **kwargs)
-        if kwargs.get("name") == "hist-test":
-            return hist_data(job, **kwargs)
-        else:
+    """Look up job functions by the ``name`` in their job record"""
+    def get(self, name):
+        try:
+            return JOBS[name]
+        except KeyError:
             raise InvalidJob
 
+    def in_process(self, name):
+        self.get(name)
+        return name in PROCESS_JOBS
 
+    def __call__(self, job, **kwargs):
+        return self.get(kwargs.get("name"))(job, **kwargs)
+
+
+@register_job("progress-test")
 def progress_test(job, **kwargs):
     time.sleep(0.5)
     set_job_status(kwargs["status"], {"status": "Dispatched..."})
@@ -48,19 +77,153 @@ def progress_test(job, **kwargs):
     return "done"
 
 
+@register_job("hist-test")
 def hist_data(job, **kwargs):
-    data = np.random.normal(size=100)
-    while data.shape[0] < 1e5:
-        data = np.hstack((data, np.random.normal(size=100)))
-        # data.sort()
-        # data = data[5:-5]
-        nbins = min(max(int(data.shape[0] ** 0.5), 10), 50)
-        hist, bins = np.histogram(data, bins=nbins)
-        xs = ((bins[:-1] + bins[1:]) / 2).tolist()
-        ys = hist.tolist()
-        set_job_status(kwargs["status"], {"data": [{"x": x, "y": y} for x, y \
-            in zip(xs, ys)], "status": "working"})
+    summary = MonteCarloSummary()
+    while summary.statistics.count < 1e5:
+        summary.add(np.random.normal(size=100))
+        set_job_status(kwargs["status"], dict(summary.as_dict(), status="working"))
         time.sleep(0.1)
-    set_job_status(kwargs["status"], {"status": "finished",
-        "data": [{"x": x, "y": y} for x, y in zip(xs, ys)]})
+    set_job_status(kwargs["status"], dict(summary.as_dict(), status="finished"))
+    return "done"
+
+
+@register_job("monte-carlo")
+def monte_carlo(job, **kwargs):
+    """Monte Carlo scores for one activity, summarized while they arrive"""
+    status = kwargs["status"]
+    iterations = kwargs["iterations"]
+    summary = MonteCarloSummary(bins=kwargs.get("bins", 50))
+    set_job_status(status, {"status": "Loading data"})
+    scores = monte_carlo_lca({tuple(kwargs["activity"]): 1}, tuple(kwargs["method"]))
+    last_update = 0
+    for _ in range(iterations):
+        summary.add(next(scores))
+        if time.time() - last_update > 0.2:
+            set_job_status(status, dict(summary.as_dict(), status="working"))
+            last_update = time.time()
+    set_job_status(status, dict(summary.as_dict(), status="finished"))
     return "done"
+
+
+@register_job("lca-report", process=True)
+def lca_report(job, **kwargs):
+    """Calculate a ``SerializedLCAReport``, with Monte Carlo on the process pool.
+
+The status id is the report UUID, so the report page can follow progress."""
+    status = kwargs["status"]
+    demand = {tuple(key): amount for key, amount in kwargs["demand"]}
+    method = tuple(kwargs["method"])
+    iterations = kwargs["iterations"]
+    cpu_count = kwargs.get("cpu_count") or multiprocessing.cpu_count()
+
+    def progress(done, statistics):
+        set_job_status(status, {
+            "status": "Monte Carlo", "job": job, "partial": True,
+            "iterations": done, "total": iterations, "statistics": statistics
+        })
+
+    set_job_status(status, {"status": "Calculating LCA results", "job": job})
+    with engine.processes(cpu_count) as executor:
+        report = ProgressLCAReport(
+            demand, method, iterations, executor, progress,
+            cpus=cpu_count, uuid=status
+        )
+        report.calculate()
+    if preferences.get('upload_reports', 0):
+        try:
+            report.upload()
+        except:
+            # No online report no cry
+            pass
+    report.write()
+    set_job_status(status, {"status": "finished", "finished": True, "job": job})
+    return report.uuid
+
+
+@register_job("lca-batch")
+def lca_batch(job, **kwargs):
+    """Score matrix for many demands and methods, stored in the status record"""
+    status = kwargs["status"]
+    demands = [
+        {tuple(key): amount for key, amount in demand}
+        for demand in kwargs["demands"]
+    ]
+    methods = [tuple(method) for method in kwargs["methods"]]
+
+    def progress(done):
+        set_job_status(status, {
+            "status": "Calculating", "job": job, "done": done, "total": len(demands)
+        })
+
+    set_job_status(status, {"status": "Loading data", "job": job})
+    scores = batch_scores(demands, methods, progress)
+    set_job_status(status, {
+        "status": "finished", "finished": True, "job": job,
+        "methods": methods, "scores": scores.tolist(),
+    })
+    return "done"
+
+
+@register_job("database-import", process=True)
+def database_import(job, **kwargs):
+    """Import an ecospold 1 file or directory as a new database"""
+    status = kwargs["status"]
+
+    def progress(data):
+        set_job_status(status, dict(data, job=job))
+
+    set_job_status(status, {"status": "Reading files", "job": job})
+    result = Ecospold1Import(kwargs["path"], kwargs["database"], progress).run()
+    set_job_status(status, dict(result, finished=True, job=job))
+    return "done"
+
+
+@register_job("method-import", process=True)
+def method_import(job, **kwargs):
+    """Import the LCIA methods of an ecospold 1 file or directory"""
+    status = kwargs["status"]
+
+    def progress(data):
+        set_job_status(status, dict(data, job=job))
+
+    set_job_status(status, {"status": "Reading files", "job": job})
+    result = MethodImport(kwargs["path"], progress, kwargs.get("unmatched")).run()
+    set_job_status(status, dict(result, finished=True, job=job))
+    return "done"
+
+
+@register_job("health-check", process=True)
+def health_check(job, **kwargs):
+    """Database health check; see ``health.run_health_check``"""
+    status = kwargs["status"]
+
+    def progress(part, done, total):
+        set_job_status(status, {
+            "status": "Checking", "job": job, "part": part, "done": done, "total": total
+        })
+
+    set_job_status(status, {"status": "Loading data", "job": job})
+    run = run_health_check(kwargs["database"], progress)
+    set_job_status(status, {
+        "status": "finished", "finished": True, "job": job, "run": run
+    })
+    return run
+
+
+@register_job("database-scores", process=True)
+def database_scores(job, **kwargs):
+    """Scores of all activities of a database for one method"""
+    status = kwargs["status"]
+
+    def progress(done, total):
+        set_job_status(status, {
+            "status": "Calculating", "job": job, "done": done, "total": total
+        })
+
+    set_job_status(status, {"status": "Loading data", "job": job})
+    number = calculate_scores(kwargs["database"], tuple(kwargs["method"]), progress)
+    set_job_status(status, {
+        "status": "finished", "finished": True, "job": job, "number": number
+    })
+    return number
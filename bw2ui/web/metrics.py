@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from collections import defaultdict
+import bisect
+import functools
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+queries = threading.local()
+
+
+def count_queries():
+    """Count SQL queries per thread, by wrapping ``peewee.Database.execute_sql``"""
+    import peewee
+    execute_sql = peewee.Database.execute_sql
+    if getattr(execute_sql, "counting", False):
+        return
+
+    @functools.wraps(execute_sql)
+    def counting_execute_sql(self, *args, **kwargs):
+        queries.count = getattr(queries, "count", 0) + 1
+        return execute_sql(self, *args, **kwargs)
+
+    counting_execute_sql.counting = True
+    peewee.Database.execute_sql = counting_execute_sql
+
+
+def reset_query_count():
+    queries.count = 0
+
+
+def query_count():
+    return getattr(queries, "count", 0)
+
+
+class Histogram(object):
+    """Cumulative Prometheus histogram: counts per upper bound, sum and count"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield "%s_bucket%s %s" % (
+                name, format_labels(dict(labels, le=format_value(bound))), cumulative)
+        yield "%s_sum%s %s" % (name, format_labels(labels), format_value(self.sum))
+        yield "%s_count%s %s" % (name, format_labels(labels), self.count)
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                     .replace("\n", "\\n"))
+        for key, value in sorted(labels.items())
+    )
+
+
+class RequestMetrics(object):
+    """Latency, response size and SQL query histograms and request counts per endpoint.
+
+Numbers are per process; with several workers, each worker reports its own."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.sizes = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+
+    def started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finished(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def observe(self, endpoint, status, seconds, size, queries):
+        with self.lock:
+            self.requests[(endpoint, status)] += 1
+            self.latency[endpoint].observe(seconds)
+            self.queries[endpoint].observe(queries)
+            if size is not None:
+                self.sizes[endpoint].observe(size)
+
+    def lines(self):
+        with self.lock:
+            yield "# HELP bw2web_requests_in_flight Requests being handled"
+            yield "# TYPE bw2web_requests_in_flight gauge"
+            yield "bw2web_requests_in_flight %s" % self.in_flight
+            yield "# HELP bw2web_requests_total Handled requests"
+            yield "# TYPE bw2web_requests_total counter"
+            for (endpoint, status), count in sorted(self.requests.items()):
+                yield "bw2web_requests_total%s %s" % (
+                    format_labels({"endpoint": endpoint, "status": status}), count)
+            for name, kind, histograms in (
+                ("bw2web_request_duration_seconds", "Request latency", self.latency),
+                ("bw2web_response_size_bytes", "Size of non-streamed responses",
+                 self.sizes),
+                ("bw2web_request_sql_queries", "SQL queries per request", self.queries),
+            ):
+                yield "# HELP %s %s" % (name, kind)
+                yield "# TYPE %s histogram" % name
+                for endpoint, histogram in sorted(histograms.items()):
+                    for line in histogram.lines(name, {"endpoint": endpoint}):
+                        yield line
+
+
+def metric_lines(name, description, value, kind="gauge"):
+    return [
+        "# HELP %s %s" % (name, description),
+        "# TYPE %s %s" % (name, kind),
+        "%s %s" % (name, format_value(value)),
+    ]
+
+
+def cache_lines(cache, engine, flights):
+    """Counters of the derived data cache, single-flight calls and the job engine"""
+    return (
+        metric_lines("bw2web_cache_hits_total", "Cache hits in memory",
+                     cache.hits, "counter")
+        + metric_lines("bw2web_cache_disk_hits_total", "Cache hits on disk",
+                       cache.disk_hits, "counter")
+        + metric_lines("bw2web_cache_misses_total", "Cache misses in memory",
+                       cache.misses, "counter")
+        + metric_lines("bw2web_cache_entries", "Cache entries in memory", len(cache))
+        + metric_lines("bw2web_single_flight_shared_total",
+                       "Calls which waited for an identical running call",
+                       cache.flights.shared + flights.shared, "counter")
+        + metric_lines("bw2web_single_flight_running", "Single-flight calls running",
+                       len(cache.flights) + len(flights))
+        + metric_lines("bw2web_jobs_running", "Queued or running jobs",
+                       len(engine.futures))
+    )
+
+
+metrics = RequestMetrics()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from bw2data import preferences, projects
+from collections import Counter, deque
+import glob
+import io
+import os
+import random
+import sys
+import threading
+import time
+
+
+def frame_name(frame):
+    code = frame.f_code
+    filename = "/".join(code.co_filename.replace(os.sep, "/").split("/")[-2:])
+    return "%s (%s:%s)" % (code.co_name, filename, code.co_firstlineno)
+
+
+def fold(frame):
+    """Stack of ``frame`` in the folded format of flamegraph tools"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SlowRequestProfiler(object):
+    """Sampling profiler for slow requests.
+
+A ``fraction`` of the requests is sampled every ``interval`` seconds. Profiles of
+sampled requests slower than ``threshold`` are written to ``directory``."""
+
+    def __init__(self, threshold, directory, interval=0.01, max_per_hour=30, keep=100,
+                 fraction=0.1):
+        self.threshold = threshold
+        self.directory = directory
+        self.interval = interval
+        self.fraction = fraction
+        self.max_per_hour = max_per_hour
+        self.keep = keep
+        self.active = {}
+        self.written = deque()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start sampling the current thread, for a ``fraction`` of the calls"""
+        if random.random() >= self.fraction:
+            return
+        with self.lock:
+            self.active[threading.current_thread().ident] = (time.time(), Counter())
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="bw2-web-profiler")
+                self.thread.daemon = True
+                self.thread.start()
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                if not self.active:
+                    self.wakeup.clear()
+                    continue
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, (_, samples) in self.active.items():
+                    if ident in frames:
+                        samples[fold(frames[ident])] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def allow(self):
+        """Rate limit for written profiles"""
+        now = time.time()
+        with self.lock:
+            while self.written and self.written[0] < now - 3600:
+                self.written.popleft()
+            if len(self.written) >= self.max_per_hour:
+                return False
+            self.written.append(now)
+            return True
+
+    def finish(self, request, queries=None):
+        """Stop sampling the current thread; write a profile if ``request`` was slow"""
+        with self.lock:
+            entry = self.active.pop(threading.current_thread().ident, None)
+        if entry is None:
+            return
+        started, samples = entry
+        duration = time.time() - started
+        if duration < self.threshold or not samples or not self.allow():
+            return
+        filepath = os.path.join(self.directory, "web-profile-%s.%03d-%s-%s" % (
+            time.strftime("%Y%m%d-%H%M%S", time.localtime(started)),
+            int(started * 1000) % 1000, request.endpoint or "unmatched", os.getpid()))
+        with io.open(filepath + ".txt", "w", encoding="utf-8") as f:
+            f.write(self.summary(request, duration, queries, samples))
+        with io.open(filepath + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write("%s %s\n" % (stack, count))
+        self.cleanup()
+
+    def summary(self, request, duration, queries, samples, limit=30):
+        total = sum(samples.values())
+        own, cumulative = Counter(), Counter()
+        for stack, count in samples.items():
+            names = stack.split(";")
+            own[names[-1]] += count
+            for name in set(names):
+                cumulative[name] += count
+        lines = [
+            "Route:       %s %s" % (request.method, request.full_path),
+            "Endpoint:    %s" % request.endpoint,
+            "Arguments:   %s" % dict(request.view_args or {}),
+            "Duration:    %.3f s" % duration,
+            "SQL queries: %s" % ("unknown" if queries is None else queries),
+            "Samples:     %s (every %s s)" % (total, self.interval),
+        ]
+        counters = (("Own samples", own), ("Cumulative samples", cumulative))
+        for title, counter in counters:
+            lines.extend(["", title, ""])
+            lines.extend(
+                "%7d %6.1f%%  %s" % (count, 100. * count / total, name)
+                for name, count in counter.most_common(limit)
+            )
+        return "\n".join(lines) + "\n"
+
+    def cleanup(self):
+        filepaths = sorted(
+            glob.glob(os.path.join(self.directory, "web-profile-*.txt")),
+            key=os.path.getmtime
+        )
+        for filepath in filepaths[:-self.keep]:
+            for extension in (".txt", ".folded"):
+                try:
+                    os.remove(filepath[:-4] + extension)
+                except OSError:
+                    pass
+
+
+def create_profiler():
+    """``SlowRequestProfiler`` with the ``web profile`` preferences, or ``None``"""
+    threshold = preferences.get("web profile threshold")
+    if not threshold:
+        return None
+    return SlowRequestProfiler(
+        threshold,
+        projects.logs_dir,
+        interval=preferences.get("web profile interval", 0.01),
+        max_per_hour=preferences.get("web profile max per hour", 30),
+        fraction=preferences.get("web profile fraction", 0.1),
+    )
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from .assets import IMMUTABLE, assets, brotli
+from .cache import project_last_modified, project_version
+from bw2data import preferences
+from flask import Response
+import gzip
+import hashlib
+import zlib
+
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+
+# Pages which only depend on project data; see ``cache.project_version``
+VERSIONED_ENDPOINTS = {
+    "index",
+    "database_explorer",
+    "activity_dataset",
+    "activity_dataset-canonical",
+    "activity_names",
+    "activity_complete",
+    "facet",
+    "method_explorer",
+    "method_cfs_table",
+    "database_tree",
+    "database_tree_json",
+    "database_schema_json",
+}
+
+# Versioned pages which list projects; these have no modification time, only an ETag
+UNDATED_ENDPOINTS = {
+    "index",
+}
+
+
+def accepted_encoding(request, streamed=False):
+    """Best content encoding accepted by the client: ``br``, ``gzip`` or ``None``.
+
+Streamed responses only use gzip."""
+    encodings = ("gzip",) if streamed or brotli is None else ("br", "gzip")
+    for encoding in encodings:
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, 6)
+
+
+def gzip_stream(original):
+    """Compress the chunks of a streamed response body while they are sent"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in original:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode("utf-8")
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Ends a ``stream_with_context`` generator if the client disconnects
+        if hasattr(original, "close"):
+            original.close()
+
+
+def set_encoding(response, encoding):
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+
+
+def finish_static(request, response):
+    """Long-lived caching for fingerprinted URLs, and precompressed content"""
+    filename = request.view_args.get("filename")
+    if request.args.get("v") and request.args["v"] == assets.fingerprint(filename):
+        response.headers["Cache-Control"] = IMMUTABLE
+    if response.status_code != 200:
+        return response
+    encoding = accepted_encoding(request)
+    content = assets.compressed(filename, encoding) if encoding else None
+    if content is None and encoding == "br":
+        encoding = "gzip"
+        content = assets.compressed(filename, encoding)
+    if content is not None:
+        # Close the file opened by ``send_static_file``
+        response.close()
+        response.direct_passthrough = False
+        response.set_data(content)
+        response.set_etag("%s-%s" % (assets.fingerprint(filename), encoding))
+        set_encoding(response, encoding)
+        response = response.make_conditional(request)
+    return response
+
+
+def data_etag():
+    return hashlib.sha1(repr(project_version()).encode("utf-8")).hexdigest()
+
+
+def is_versioned(request):
+    return request.method in ("GET", "HEAD") and request.endpoint in VERSIONED_ENDPOINTS
+
+
+def set_validators(request, response):
+    response.set_etag(data_etag(), weak=True)
+    # Always revalidate; private, as the project can come from a cookie
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    if request.endpoint not in UNDATED_ENDPOINTS:
+        response.last_modified = project_last_modified()
+
+
+def conditional_response(request):
+    """Empty 304 response if the client has the current page, else ``None``"""
+    if not is_versioned(request):
+        return None
+    if request.if_none_match:
+        if not request.if_none_match.contains_weak(data_etag()):
+            return None
+    elif request.endpoint in UNDATED_ENDPOINTS:
+        return None
+    else:
+        last_modified = project_last_modified()
+        if (request.if_modified_since is None or last_modified is None
+                or request.if_modified_since < last_modified):
+            return None
+    response = Response(status=304)
+    set_validators(request, response)
+    return response
+
+
+def finish_response(request, response):
+    """Add caching headers and compress ``response``"""
+    if request.endpoint == "static":
+        return finish_static(request, response)
+    if response.status_code == 200 and is_versioned(request):
+        set_validators(request, response)
+    if (response.status_code != 200 or request.method == "HEAD"
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.is_streamed:
+        if accepted_encoding(request, streamed=True):
+            response.response = gzip_stream(response.response)
+            set_encoding(response, "gzip")
+        return response
+    data = response.get_data()
+    if len(data) < preferences.get("web compress threshold", 2048):
+        return response
+    encoding = accepted_encoding(request)
+    if encoding:
+        response.set_data(compress(data, encoding))
+        set_encoding(response, encoding)
+    return response
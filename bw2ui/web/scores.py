@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from .cache import cache, dependency_version, method_version
+from .calculations import factorized_lca, is_legacy_bc
+from .indexes import ActivityDataset
+from bw2data import projects
+import hashlib
+import numpy as np
+import os
+
+
+def scores_version(database, method):
+    return repr((dependency_version(database), method_version(method)))
+
+
+def scores_filepath(database, method):
+    """File with the scores of all activities of ``database`` for ``method``"""
+    name = "".join(c if c.isalnum() else "_" for c in database)[:40]
+    digest = hashlib.sha1(
+        repr((database, tuple(method))).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(
+        projects.request_directory("scores"), "%s.%s.npz" % (name, digest))
+
+
+def load_scores(filepath, version):
+    with np.load(filepath, allow_pickle=False) as f:
+        if str(f["version"]) != version:
+            return None
+        return dict(zip(f["codes"].tolist(), f["scores"].tolist()))
+
+
+def stored_scores(database, method):
+    """Dictionary from activity code to score, or ``None`` if not calculated yet"""
+    filepath = scores_filepath(database, method)
+    try:
+        mtime = os.path.getmtime(filepath)
+    except OSError:
+        return None
+    version = scores_version(database, method)
+    return cache.get(
+        ("database-scores", database, tuple(method)),
+        (version, mtime),
+        lambda: load_scores(filepath, version)
+    )
+
+
+def activity_columns(lca, database):
+    """Activity codes of ``database`` and their product keys in the matrices"""
+    products = lca.products
+    if is_legacy_bc():
+        keys = {key[1]: key for key in products if key[0] == database}
+    else:
+        ids = dict(ActivityDataset.select(
+            ActivityDataset.id, ActivityDataset.code
+        ).where(ActivityDataset.database == database).tuples())
+        keys = {ids[key]: key for key in products if key in ids}
+    codes = sorted(keys)
+    return codes, [keys[code] for code in codes]
+
+
+def calculate_scores(database, method, progress=None):
+    """Store the scores of all activities of ``database``; returns their number"""
+    version = scores_version(database, method)
+    first = ActivityDataset.select(ActivityDataset.code).where(
+        ActivityDataset.database == database).limit(1).tuples()
+    lca = factorized_lca({(database, code): 1 for (code,) in first}, method)
+    codes, keys = activity_columns(lca, database)
+    scores = lca.scores(
+        [{key: 1} for key in keys], [method],
+        progress=progress and (lambda done: progress(done, len(keys)))
+    )[0]
+    filepath = scores_filepath(database, method)
+    temp_filepath = "%s.%s.tmp.npz" % (filepath[:-4], os.getpid())
+    np.savez(temp_filepath, version=np.array(version), codes=np.array(codes, dtype=str),
+             scores=scores)
+    os.replace(temp_filepath, filepath)
+    return len(codes)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from .cache import cache
+from .engine import engine
+from bw2data import preferences
+
+
+def serve(app, host, port, workers, warm=False):
+    """Serve ``app`` with ``workers`` pre-forked gunicorn processes"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise ImportError(
+            "Serving with several workers needs gunicorn (`pip install gunicorn`), "
+            "which is not available on Windows"
+        )
+
+    class Application(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super(Application, self).__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    def post_fork(server, worker):
+        from .warm import start_warming
+        start_warming()
+
+    cache.enable_disk()
+    engine.share()
+    options = {
+        "bind": "%s:%s" % (host, port),
+        "workers": workers,
+        # Threads keep long-lived status streams from blocking a worker
+        "worker_class": "gthread",
+        "threads": preferences.get("web worker threads", 8),
+        "timeout": 120,
+    }
+    if warm:
+        options["post_fork"] = post_fork
+    Application(app, options).run()
+
+
+def serve_async(host, port, warm=False):
+    """Serve the ASGI application of ``asgi.AsyncApp`` with uvicorn, in one process"""
+    try:
+        import uvicorn
+    except ImportError:
+        raise ImportError(
+            "The async serving mode needs uvicorn (`pip install uvicorn`)")
+    from .asgi import create_asgi_app
+
+    if warm:
+        from .warm import start_warming
+        start_warming()
+    uvicorn.run(create_asgi_app(), host=host, port=port, log_level="warning")
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+import math
+import numpy as np
+
+
+class StreamingHistogram(object):
+    """Histogram with a constant number of bins, updated one batch of samples at a time.
+
+Without ``lower`` and ``upper``, the range is chosen from the first ``warmup`` samples,
+and doubled when needed. Infinite and NaN samples are only counted as ``nonfinite``."""
+
+    def __init__(self, bins=50, lower=None, upper=None, warmup=100):
+        if bins % 2:
+            raise ValueError("Number of bins must be even")
+        self.bins = bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.fixed = lower is not None and upper is not None
+        self.underflow = self.overflow = self.nonfinite = 0
+        self.warmup = warmup
+        self.buffer = []
+        if self.fixed:
+            self.lower, self.width = float(lower), (upper - lower) / float(bins)
+        else:
+            self.lower = self.width = None
+
+    @property
+    def upper(self):
+        return self.lower + self.width * self.bins
+
+    def add(self, values):
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        finite = np.isfinite(values)
+        if not finite.all():
+            # The range would grow without end
+            self.nonfinite += int((~finite).sum())
+            values = values[finite]
+        if self.lower is None:
+            self.buffer.extend(values.tolist())
+            if len(self.buffer) < self.warmup:
+                return
+            values, self.buffer = np.array(self.buffer), []
+            self._initial_range(values.min(), values.max())
+        if not values.shape[0]:
+            return
+        if self.fixed:
+            self.underflow += int((values < self.lower).sum())
+            self.overflow += int((values >= self.upper).sum())
+            values = values[(values >= self.lower) & (values < self.upper)]
+        else:
+            while values.min() < self.lower:
+                self._grow(left=True)
+            while values.max() >= self.upper:
+                self._grow(left=False)
+        indices = ((values - self.lower) / self.width).astype(np.int64)
+        self.counts += np.bincount(
+            np.clip(indices, 0, self.bins - 1), minlength=self.bins
+        )
+
+    def _initial_range(self, lower, upper):
+        if upper == lower:
+            upper = lower + (abs(lower) or 1.) * 1e-3
+        # Pad so that the maximum falls inside the last bin
+        self.width = (upper - lower) / self.bins * (1 + 1e-9)
+        self.lower = lower
+
+    def _grow(self, left):
+        merged = self.counts.reshape(-1, 2).sum(axis=1)
+        empty = np.zeros(self.bins // 2, dtype=np.int64)
+        if left:
+            self.counts = np.hstack((empty, merged))
+            self.lower -= self.width * self.bins
+        else:
+            self.counts = np.hstack((merged, empty))
+        self.width *= 2
+
+    def points(self):
+        """``[{"x": bin center, "y": count}]``, without empty bins at either end"""
+        if self.lower is None:
+            if not self.buffer:
+                return []
+            counts, edges = np.histogram(self.buffer, bins=min(self.bins, 10))
+        else:
+            counts = self.counts
+            edges = self.lower + self.width * np.arange(self.bins + 1)
+        nonzero = np.nonzero(counts)[0]
+        if not nonzero.shape[0]:
+            return []
+        start, end = nonzero[0], nonzero[-1] + 1
+        centers = (edges[:-1] + edges[1:]) / 2
+        return [
+            {"x": float(x), "y": int(y)}
+            for x, y in zip(centers[start:end], counts[start:end])
+        ]
+
+
+class P2Quantile(object):
+    """Estimate quantile ``p`` with the P-squared algorithm (Jain and Chlamtac, 1985)"""
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q, n = self.heights, self.positions
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0], k = x, 0
+        elif x >= q[4]:
+            q[4], k = x, 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            return float(np.percentile(self.heights, self.p * 100))
+        return float(self.heights[2])
+
+
+class RunningStatistics(object):
+    """Count, mean, standard deviation, minimum and maximum (Welford's algorithm)"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = self.m2 = 0.
+        self.min = self.max = None
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.
+
+
+class MonteCarloSummary(object):
+    """Histogram, quantiles and moments of a stream of Monte Carlo scores.
+
+Infinite and NaN scores are left out, and counted as ``nonfinite``."""
+
+    def __init__(self, bins=50, quantiles=(0.025, 0.5, 0.975), lower=None, upper=None):
+        self.histogram = StreamingHistogram(bins, lower, upper)
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+        self.statistics = RunningStatistics()
+
+    def add(self, values):
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        self.histogram.add(values)
+        # Only counted by the histogram; they would spoil the statistics
+        for x in values[np.isfinite(values)].tolist():
+            self.statistics.add(x)
+            for quantile in self.quantiles:
+                quantile.add(x)
+
+    def as_dict(self):
+        return {
+            "data": self.histogram.points(),
+            "iterations": self.statistics.count + self.histogram.nonfinite,
+            "nonfinite": self.histogram.nonfinite,
+            "statistics": {
+                "mean": self.statistics.mean,
+                "std": self.statistics.std,
+                "min": self.statistics.min,
+                "max": self.statistics.max,
+                "quantiles": [[q.p, q.value()] for q in self.quantiles],
+            },
+        }
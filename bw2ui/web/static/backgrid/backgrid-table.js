@@ -59,3 +59,48 @@ var BackgridTable = function (data, columns, selector, fields, placeholder, nrow
 
   return grid;
 };
+
+
+// Paginate, sort and filter on the server. `state` and `data` are the first
+// page, as returned by `utils.table_page`, so the table renders without a request.
+var ServerBackgridTable = function (url, state, data, columns, selector, placeholder, click_callback) {
+  var bgCollection = Backbone.PageableCollection.extend({
+    model: Backbone.Model.extend({}),
+    url: url,
+    state: {
+      pageSize: state.per_page,
+      totalRecords: state.total_entries
+    },
+    mode: "server"
+  });
+  var collection = new bgCollection(data);
+  var grid = new Backgrid.Grid({
+    columns: columns,
+    collection: collection,
+    row: ClickableRow
+  });
+
+  var element = $(selector);
+  element.append(grid.render().$el);
+
+  var paginator = new Backgrid.Extension.Paginator({
+    collection: collection
+  });
+  element.append(paginator.render().$el);
+
+  if (placeholder) {
+    var filter = new Backgrid.Extension.ServerSideFilter({
+      collection: collection,
+      name: "q",
+      placeholder: placeholder
+    });
+    element.prepend(filter.render().$el);
+    filter.$el.css({float: "right", margin: "20px"});
+  }
+
+  if (click_callback) {
+    Backbone.on("rowclicked", click_callback);
+  }
+
+  return grid;
+};
@@ -59,9 +59,22 @@ if(jQuery) (function($){
 					});
 				}
 				
+				// Replace a "more files" entry with the next page of the listing
+				function showMore(a) {
+					var li = a.parent();
+					li.addClass('wait');
+					$.post(o.script, { dir: escape(a.attr('rel')), cursor: a.data('cursor') }, function(data) {
+						var items = $(data).children('LI');
+						li.replaceWith(items);
+						bindTree(items);
+					});
+				}
+
 				function bindTree(t) {
 					$(t).find('LI A').bind(o.folderEvent, function() {
-						if( $(this).parent().hasClass('directory') ) {
+						if( $(this).parent().hasClass('more') ) {
+							showMore($(this));
+						} else if( $(this).parent().hasClass('directory') ) {
 							if( $(this).parent().hasClass('collapsed') ) {
 								// Expand
 								if( !o.multiFolder ) {
@@ -0,0 +1,52 @@
+// Follow the status of a job, calling `callback(status)` on every change.
+// Uses the Server-Sent Events stream at `status_url + "/stream"` when the
+// browser supports it, and polls `status_url` every `interval` ms otherwise.
+var watch_job_status = function (status_url, callback, interval) {
+  var status = {},
+    done = false;
+
+  var finished = function (s) {
+    return s.finished === true || s.status === "finished" ||
+      s.status === "cancelled" || s.status === "error";
+  };
+
+  var poll = function () {
+    var timer = setInterval(function () {
+      $.getJSON(status_url, function (data) {
+        status = data;
+        callback(status);
+        if (finished(status)) {
+          clearInterval(timer);
+        }
+      });
+    }, interval || 250);
+  };
+
+  if (!window.EventSource) {
+    poll();
+    return;
+  }
+
+  var source = new EventSource(status_url + "/stream");
+  source.onmessage = function (e) {
+    var delta = JSON.parse(e.data);
+    for (var key in delta) {
+      if (delta[key] === null) {
+        delete status[key];
+      } else {
+        status[key] = delta[key];
+      }
+    }
+    callback(status);
+  };
+  source.addEventListener("end", function () {
+    done = true;
+    source.close();
+  });
+  source.onerror = function () {
+    source.close();
+    if (!done && !finished(status)) {
+      poll();
+    }
+  };
+};
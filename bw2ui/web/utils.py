@@ -2,20 +2,63 @@
 from __future__ import print_function, unicode_literals
 from eight import *
 
-from brightway2 import projects, JsonWrapper
-from flask import Response
+from .engine import engine
+from bw2data import JsonWrapper, preferences
+from collections.abc import Iterator
+from flask import Response, stream_with_context
+import json
 import os
+import time
 import uuid
 
-jobs_dir = projects.request_directory("jobs")
-
 
 def set_job_status(job, status):
-    JsonWrapper.dump(status, os.path.join(jobs_dir, "%s.json" % job))
+    engine.set_status(job, status)
 
 
 def get_job(job):
-    return JsonWrapper.load(os.path.join(jobs_dir, "%s.json" % job))
+    return engine.get_status(job)
+
+
+def is_finished(status):
+    return status.get("finished") is True or status.get("status") in (
+        "finished", "cancelled", "error")
+
+
+def status_delta(old, new):
+    """Keys of ``new`` which differ from ``old``; removed keys are ``None``"""
+    delta = {k: v for k, v in new.items() if k not in old or old[k] != v}
+    delta.update({k: None for k in old if k not in new})
+    return delta
+
+
+def status_stream(job, interval=None, keepalive=15):
+    """Server-Sent Events with the changes to the status of ``job``"""
+    if interval is None:
+        interval = preferences.get("web status interval", 0.25)
+    last, version = {}, None
+    while True:
+        try:
+            version, status = engine.store.wait(job, version, keepalive)
+        except KeyError:
+            break
+        delta = status_delta(last, status)
+        if delta:
+            yield "data: %s\n\n" % json.dumps(delta)
+            last = status
+        else:
+            yield ": keepalive\n\n"
+        if is_finished(status):
+            break
+        time.sleep(interval)
+    yield "event: end\ndata: {}\n\n"
+
+
+def event_stream_response(generator):
+    return Response(generator, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
 
 
 def get_job_id():
@@ -25,5 +68,81 @@ def get_job_id():
 def json_response(data):
     return Response(JsonWrapper.dumps(data), mimetype='application/json')
 
+
+def iter_json(data):
+    """Serialize ``data`` to JSON in pieces, one item or element at a time"""
+    if isinstance(data, dict):
+        yield "{"
+        for index, (key, value) in enumerate(data.items()):
+            yield "%s%s:" % ("," if index else "", JsonWrapper.dumps(str(key)))
+            for piece in iter_json(value):
+                yield piece
+        yield "}"
+    elif isinstance(data, (list, tuple, Iterator)):
+        yield "["
+        for index, row in enumerate(data):
+            yield ("," if index else "") + JsonWrapper.dumps(row)
+        yield "]"
+    else:
+        yield JsonWrapper.dumps(data)
+
+
+def buffered(pieces, size=65536):
+    """Join small strings from ``pieces`` into chunks of about ``size`` characters"""
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def json_stream_response(data):
+    """Like ``json_response``, but serialized while the response is sent"""
+    return Response(
+        stream_with_context(buffered(iter_json(data))),
+        mimetype='application/json'
+    )
+
 def get_dynamic_media_folder():
     return os.path.join(os.path.dirname(__file__), u"static", u"dynamic")
+
+
+def get_int_arg(args, name, default, minimum=None, maximum=None):
+    try:
+        value = int(args.get(name, default))
+    except (TypeError, ValueError):
+        value = default
+    if minimum is not None:
+        value = max(value, minimum)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def table_page(rows, args, formatter=None, fields=("name",), max_per_page=1000):
+    """``[state, rows]`` of one page of ``rows``, for ``Backbone.PageableCollection``"""
+    query = args.get("q", "").strip().lower()
+    if query:
+        rows = [
+            row for row in rows
+            if any(query in str(row.get(field, "")).lower() for field in fields)
+        ]
+    sort_by = args.get("sort_by")
+    if sort_by and rows and sort_by in rows[0]:
+        rows = sorted(
+            rows,
+            key=lambda x: (x[sort_by] is None, x[sort_by]),
+            reverse=args.get("order") == "desc"
+        )
+    per_page = get_int_arg(args, "per_page", 50, 1, max_per_page)
+    page = get_int_arg(args, "page", 1, 1)
+    start = (page - 1) * per_page
+    data = rows[start:start + per_page]
+    if formatter:
+        data = [formatter(row) for row in data]
+    state = {"page": page, "per_page": per_page, "total_entries": len(rows)}
+    return [state, data]
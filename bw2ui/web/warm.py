@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, unicode_literals
+from eight import *
+
+from .assets import assets
+from .calculations import factorized_lca
+from .context import gate
+from .indexes import ActivityDataset, adjacency, completion_index, \
+    method_abbreviations, method_cfs, short_names
+from bw2data import config, databases, methods, preferences, projects
+import logging
+import threading
+import time
+
+logger = logging.getLogger("bw2ui.web")
+
+
+def process_key(database):
+    """Key of some process in ``database``, or ``None``"""
+    row = ActivityDataset.select(ActivityDataset.code).where(
+        (ActivityDataset.database == database) & (ActivityDataset.type == "process")
+    ).first()
+    return (database, row.code) if row else None
+
+
+def warm_steps():
+    """``(description, function)`` pairs filling the caches used by the web pages"""
+    names = [
+        name for name in preferences.get("web warm databases") or sorted(databases)
+        if name in databases
+    ]
+    yield "static assets", assets.precompress
+    yield "method abbreviations", method_abbreviations
+    for name in names:
+        yield "short names of %s" % name, lambda name=name: short_names(name)
+        yield ("autocomplete index of %s" % name,
+               lambda name=name: completion_index(name))
+        yield "supply chain index of %s" % name, lambda name=name: adjacency(name)
+    method = tuple(config.p.get("preferred lcia method", ()))
+    if method not in methods:
+        return
+    yield "CFs of %s" % "-".join(method), lambda: method_cfs(method)
+    for name in names:
+        key = process_key(name)
+        if key:
+            yield "LCA of %s" % name, lambda key=key: factorized_lca({key: 1}, method)
+
+
+def warm(project=None):
+    """Fill the caches of ``project``, logging the time of each step"""
+    project = project or projects.current
+    start = time.time()
+    with gate.use(project):
+        steps = list(warm_steps())
+    for description, func in steps:
+        step_start = time.time()
+        try:
+            with gate.use(project):
+                func()
+        except Exception:
+            logger.exception("Warming %s failed", description)
+            continue
+        logger.info("Warmed %s in %.2f s", description, time.time() - step_start)
+    logger.info("Warmed caches of project %s in %.2f s", project, time.time() - start)
+
+
+def start_warming(project=None):
+    """Warm caches in a background thread, so that requests are answered right away"""
+    thread = threading.Thread(
+        target=warm, args=(project or projects.current,), name="bw2-web-warm")
+    thread.daemon = True
+    thread.start()
+    return thread
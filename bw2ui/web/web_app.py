@@ -4,17 +4,30 @@ from eight import *
 from future.standard_library import install_aliases
 install_aliases()
 
+from .assets import assets
+from .calculations import batch_scores, factorized_lca
+from .context import gate, ProjectBusy, PROJECT_COOKIE
+from .cache import cache, flights, project_version, dependency_version
+from .engine import engine, QueueFull
+from .files import lister
+from .health import health_check_directory, health_check_result, health_check_run
 from .jobs import JobDispatch, InvalidJob
+from .metrics import metrics, cache_lines, count_queries, query_count, \
+    reset_query_count
+from .profiling import create_profiler
+from .responses import conditional_response, finish_response
+from .scores import scores_filepath, scores_version, stored_scores
+from .indexes import ActivityDataset, method_abbreviations, method_cfs, \
+    short_names, activity_tree, completion_index, database_schema
 from .utils import get_job_id, get_job, set_job_status, json_response, \
-    get_dynamic_media_folder
-from bw2analyzer import DatabaseExplorer, SerializedLCAReport, DatabaseHealthCheck
+    table_page, status_stream, event_stream_response, get_int_arg, \
+    json_stream_response, is_finished
 from bw2calc.speed_test import SpeedTest
-from bw2calc.lca import LCA
 from bw2data import (
+    config,
     Database,
     databases,
     JsonWrapper,
-    Method,
     methods,
     preferences,
     projects,
@@ -22,13 +35,14 @@ from bw2data import (
 )
 from bw2data.search import Searcher
 from bw2io import bw2setup
-from flask import url_for, render_template, request, redirect, abort
-from genson import SchemaBuilder
-from stats_arrays import uncertainty_choices
+from flask import url_for, render_template, request, redirect, abort, g, \
+    Response, send_file, send_from_directory
 from urllib.parse import unquote
+import hashlib
 import multiprocessing
 import os
-import pprint
+import re
+import time
 
 from . import bw2webapp
 
@@ -54,6 +68,117 @@ https://github.com/simogeo/Filemanager/issues/40
 ###########################
 
 
+# Don't need project data, and shouldn't wait for a project switch
+PROJECT_FREE_ENDPOINTS = {
+    "static", "ping", "prometheus_metrics", "job_status", "job_status_stream",
+    "job_cancel", "fp_api",
+}
+DEFAULT_PROJECT = projects.current
+
+
+def request_project():
+    """Project of the current request: from the URL, ``?project=``, or the cookie"""
+    if request.view_args and request.view_args.get("projectname"):
+        return request.view_args["projectname"]
+    if request.args.get("project"):
+        if request.args["project"] not in projects:
+            abort(404)
+        return request.args["project"]
+    # The response depends on the cookie; see ``remember_project``
+    g.project_cookie = True
+    cookie = request.cookies.get(PROJECT_COOKIE)
+    if cookie and cookie in projects:
+        return cookie
+    return DEFAULT_PROJECT
+
+
+count_queries()
+profiler = create_profiler()
+
+
+# Registered first: runs before the other ``before_request`` functions, and after the
+# other ``after_request`` functions, so that it sees the final response.
+@bw2webapp.before_request
+def start_request_metrics():
+    g.started = time.time()
+    reset_query_count()
+    metrics.started()
+
+
+@bw2webapp.after_request
+def record_request_metrics(response):
+    metrics.observe(
+        request.endpoint or "unmatched",
+        response.status_code,
+        time.time() - g.started,
+        None if response.is_streamed else response.content_length,
+        query_count()
+    )
+    return response
+
+
+@bw2webapp.teardown_request
+def finish_request_metrics(exc=None):
+    if "started" in g:
+        metrics.finished()
+
+
+@bw2webapp.before_request
+def start_profiling():
+    if profiler:
+        profiler.start()
+
+
+@bw2webapp.teardown_request
+def finish_profiling(exc=None):
+    if profiler:
+        profiler.finish(request, query_count())
+
+
+@bw2webapp.before_request
+def enter_project():
+    if request.endpoint not in PROJECT_FREE_ENDPOINTS:
+        try:
+            gate.enter(request_project(), preferences.get("web project wait", 30))
+        except ProjectBusy:
+            # Another project is in use, e.g. by a long job
+            abort(503)
+
+
+@bw2webapp.before_request
+def not_modified():
+    # After ``enter_project``, as the data version is per project
+    return conditional_response(request)
+
+
+@bw2webapp.teardown_request
+def exit_project(exc=None):
+    gate.exit()
+
+
+@bw2webapp.after_request
+def remember_project(response):
+    if request.view_args and request.view_args.get("projectname"):
+        response.set_cookie(PROJECT_COOKIE, request.view_args["projectname"])
+    if g.get("project_cookie"):
+        response.vary.add("Cookie")
+    return response
+
+
+@bw2webapp.after_request
+def cache_and_compress(response):
+    return finish_response(request, response)
+
+
+@bw2webapp.url_defaults
+def fingerprint_static(endpoint, values):
+    """Add a content hash to static URLs, so that they can be cached for a long time"""
+    if endpoint == "static" and "v" not in values:
+        fingerprint = assets.fingerprint(values.get("filename", ""))
+        if fingerprint:
+            values["v"] = fingerprint
+
+
 @bw2webapp.errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
@@ -71,21 +196,61 @@ def internal_error(e):
 @bw2webapp.route("/status/<job>")
 def job_status(job):
     try:
-        return json_response(get_job(job))
-    except:
+        return json_stream_response(get_job(job))
+    except KeyError:
         abort(404)
 
 
+@bw2webapp.route("/status/<job>/stream")
+def job_status_stream(job):
+    try:
+        get_job(job)
+    except KeyError:
+        abort(404)
+    return event_stream_response(status_stream(job))
+
+
+def dispatch(job, job_data):
+    """Run ``job`` in the background, in the project it was created in"""
+    project, name = job_data.get("project") or projects.current, job_data.get("name")
+    if JobDispatch().in_process(name):
+        # Long jobs don't hold the project gate
+        def func(job, **kwargs):
+            try:
+                return engine.run_in_process(project, job, kwargs)
+            finally:
+                gate.reload(project)
+    else:
+        func = gate.wrap(project, JobDispatch().get(name))
+    return engine.submit(job, func, job, **job_data)
+
+
 @bw2webapp.route("/dispatch/<job>")
 def job_dispatch(job):
     try:
         job_data = get_job(job)
-    except:
+    except KeyError:
         abort(404)
+    if job_data.get("state"):
+        # Already queued or running, e.g. page reload
+        return json_response({"job": job, "state": job_data["state"]})
     try:
-        return JobDispatch()(job, **job_data)
+        dispatch(job, job_data)
     except InvalidJob:
         abort(500)
+    except QueueFull:
+        abort(503)
+    return json_response({"job": job, "state": "queued"})
+
+
+@bw2webapp.route("/cancel/<job>", methods=["POST"])
+def job_cancel(job):
+    try:
+        get_job(job)
+    except KeyError:
+        abort(404)
+    engine.cancel(job)
+    return json_response({"job": job, "cancelled": True})
 
 ###################
 ### File Picker ###
@@ -99,52 +264,33 @@ def fp_test():
 
 @bw2webapp.route("/fp-api", methods=["POST"])
 def fp_api():
-    full = bool(request.args.get("full", False))
+    """One page of a directory listing; the ``cursor`` form field gives the next page.
+
+Returns HTML for jQueryFileTree, or JSON with ``?format=json``."""
     path = jqfilepicker_unquote(request.form["dir"])
+    limit = get_int_arg(
+        request.args, "limit", 1000 if request.args.get("full") else 100, 1, 10000)
     try:
-        root, dirs, files = os.walk(path).next()
-    except StopIteration:
-        try:
-            # Only files from now on...
-            root, dirs = path, []
-            files = os.listdir(root)
-        except:
-            # Don't have permissions for this directory or other OS error
-            files = []
-    data = []
-    files = [x for x in files if x[0] != "."]
-    if not full and len(files) > 20:
-        files = files[:20] + ["(and %s more files...)" % (len(files) - 20)]
-    for dir_name in dirs:
-        if dir_name[0] == ".":
-            continue
-        data.append({
-            "dir": True,
-            "path": os.path.join(root, dir_name),
-            "name": dir_name
-        })
-    for file_name in files:
-        data.append({
-            "dir": False,
-            "ext": file_name.split(".")[-1].lower(),
-            "path": os.path.join(root, file_name),
-            "name": file_name
-        })
-    return render_template("fp-select.html", dirtree=data)
+        entries, cursor = lister.listing(path, request.form.get("cursor"), limit)
+    except ValueError:
+        abort(400)
+    if request.args.get("format") == "json":
+        return json_response({"entries": entries, "cursor": cursor})
+    return render_template("fp-select.html", dirtree=entries, dir=path, cursor=cursor)
 
 #######################
 ### Getting started ###
 #######################
 
-# def get_windows_drives():
-#     if not config._windows:
-#         return {'windows': False}
-#     else:
-#         return {
-#             'windows': True,
-#             'drive_letters': get_windows_drive_letters(),
-#             'current_drive': os.path.splitdrive(os.getcwd())[0]
-#         }
+def get_windows_drives():
+    if not config._windows:
+        return {'windows': False}
+    else:
+        return {
+            'windows': True,
+            'drive_letters': get_windows_drive_letters(),
+            'current_drive': os.path.splitdrive(os.getcwd())[0]
+        }
 
 # @bw2webapp.route('/start/path', methods=["POST"])
 # def set_path():
@@ -176,25 +322,85 @@ def fp_api():
 
 @bw2webapp.route("/import/database", methods=["GET", "POST"])
 def import_database():
+    """Import an ecospold 1 file or directory as a job; returns its status record id"""
     if request.method == "GET":
         return render_template("import-database.html", **get_windows_drives())
-    else:
-        raise NotImplemented
-        path = unquote(request.form["path"])
-        name = unquote(request.form["name"])
-        Ecospold1Importer().importer(path, name)
-        return "1"
+    path = jqfilepicker_unquote(request.form.get("path", ""))
+    name = request.form.get("name", "").strip()
+    if not name or not os.path.exists(path):
+        abort(400)
+    if name in databases:
+        abort(409)
+    status_id = get_job_id()
+    job_id = get_job_id()
+    job_data = {
+        "name": "database-import",
+        "project": projects.current,
+        "status": status_id,
+        "path": path,
+        "database": name,
+    }
+    set_job_status(job_id, job_data)
+    set_job_status(status_id, {"status": "Queued", "job": job_id})
+    try:
+        dispatch(job_id, job_data)
+    except QueueFull:
+        abort(503)
+    return json_response({
+        "job": job_id,
+        "status": status_id,
+        "url": url_for("job_status", job=status_id),
+    })
+
+
+def unmatched_cfs_filepath(status):
+    return os.path.join(
+        projects.request_directory("imports"), "unmatched.%s.csv" % status)
 
 
 @bw2webapp.route("/import/method", methods=["GET", "POST"])
 def import_method():
+    """Import ecospold 1 LCIA methods as a job; returns its status record id"""
     if request.method == "GET":
         return render_template("import-method.html", **get_windows_drives())
-    else:
-        raise NotImplemented
-        path = unquote(request.form["path"])
-        EcospoldImpactAssessmentImporter().importer(path)
-        return "1"
+    path = jqfilepicker_unquote(request.form.get("path", ""))
+    if not os.path.exists(path):
+        abort(400)
+    status_id = get_job_id()
+    job_id = get_job_id()
+    job_data = {
+        "name": "method-import",
+        "project": projects.current,
+        "status": status_id,
+        "path": path,
+        "unmatched": unmatched_cfs_filepath(status_id),
+    }
+    set_job_status(job_id, job_data)
+    set_job_status(status_id, {"status": "Queued", "job": job_id})
+    try:
+        dispatch(job_id, job_data)
+    except QueueFull:
+        abort(503)
+    return json_response({
+        "job": job_id,
+        "status": status_id,
+        "url": url_for("job_status", job=status_id),
+        "unmatched": url_for("import_method_unmatched", status=status_id),
+    })
+
+
+@bw2webapp.route("/import/method/<status>/unmatched.csv")
+def import_method_unmatched(status):
+    """CFs of a method import which didn't match any biosphere flow"""
+    if not re.match(r"^[0-9a-f]{32}$", status):
+        abort(404)
+    filepath = unmatched_cfs_filepath(status)
+    if not os.path.exists(filepath):
+        abort(404)
+    return send_file(
+        filepath, mimetype="text/csv", as_attachment=True,
+        download_name="unmatched-cfs.csv"
+    )
 
 ###################
 ### Basic views ###
@@ -204,9 +410,6 @@ def import_method():
 @bw2webapp.route('/')
 @bw2webapp.route('/project/<projectname>')
 def index(projectname=None):
-    if projectname is None:
-        projectname = 'default'
-    projects.set_current(projectname)
     dbs = [{
         "name": key,
         "number": value.get("number", 0),
@@ -234,6 +437,12 @@ def index(projectname=None):
     return render_template("index.html", **context)
 
 
+@bw2webapp.route('/metrics')
+def prometheus_metrics():
+    lines = list(metrics.lines()) + cache_lines(cache, engine, flights)
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
 @bw2webapp.route('/ping', methods=['GET'])
 def ping():
     # Used to check if web UI is running
@@ -282,7 +491,6 @@ def whoosh_search():
         abort(400)
 
     data = {'results': Searcher().search(request_data['search_string'])}
-    print(data)
     return json_response(data)
 
 
@@ -321,6 +529,7 @@ def database_explorer(name):
         health_check_url=url_for('database_health_check', database=name),
         backup_url = url_for('backup_database', database=name),
         delete_url = url_for('delete_database', database=name),
+        scores_url = url_for('database_scores', name=name),
         location_facet_url = url_for('facet', database=name, facet="location"),
         unit_facet_url = url_for('facet', database=name, facet="unit"),
     )
@@ -341,26 +550,95 @@ def backup_database(database):
     return Database(database).backup()
 
 
+def scores_status_id(database, method):
+    """Status record id of the scores job for the current ``database`` and ``method``"""
+    return hashlib.sha1(repr((
+        projects.current, scores_filepath(database, method),
+        scores_version(database, method))).encode("utf-8")).hexdigest()[:32]
+
+
+@bw2webapp.route("/database/<name>/scores", methods=["GET", "POST"])
+def database_scores(name):
+    """Scores of all activities for the preferred LCIA method; POST starts a job"""
+    if name not in databases:
+        return abort(404)
+    method = tuple(config.p.get("preferred lcia method", ()))
+    if method not in methods:
+        return json_response({"method": None, "scores": None, "status": None})
+    scores = stored_scores(name, method)
+    status_id = scores_status_id(name, method)
+    if scores is None and request.method == "POST":
+        flights.do(("start_job_once", status_id), lambda: start_job_once(
+            status_id, {"name": "database-scores", "database": name, "method": method},
+            retry=True))
+    try:
+        get_job(status_id)
+        status_url = url_for("job_status", job=status_id)
+    except KeyError:
+        status_url = None
+    return json_response({
+        "method": method,
+        "unit": methods[method].get("unit", ""),
+        "scores": scores,
+        "status": status_url,
+    })
+
+
 @bw2webapp.route("/view/<database>/<code>", endpoint="activity_dataset-canonical")
 @bw2webapp.route("/view/<database>/<code>/sc_graph")
 def activity_dataset(database, code, sc_graph_json=False):
     if database not in databases:
         return abort(404)
+    if request.url_rule.rule[-9:] == "/sc_graph":
+        try:
+            the_activity_data = get_activity((database, code)).as_dict()
+        except KeyError:
+            return abort(404)
+        return json_stream_response({
+        'id': database + "-" + code,
+        'name': the_activity_data.get('name', "Unknown"),
+        'data': {'origin': True},
+        'children': (
+            format_sc(exc['input'])
+            for exc in the_activity_data.get('exchanges', []) 
+            if 'input' in exc
+            and exc['type'] == "technosphere"
+        )})
+    # Concurrent requests for the same page share one rendering
+    return flights.do(
+        ("activity_dataset", database, code, project_version()),
+        lambda: render_activity(database, code))
+
+
+def format_sc(key):
+    a = get_activity(key)
+    return {
+        'id': "-".join(key),
+        'children': [],
+        'name': a.get('name', "Unknown"),
+        'data': {'url': url_for('activity_dataset-canonical', 
+            database=a.get('database'), 
+            code=a.get('code'))},
+    }
+
+
+def render_activity(database, code):
     try:
         the_activity = get_activity((database, code))
         the_activity_data = the_activity.as_dict()
     except KeyError:
         return abort(404)
 
-    try:
-        preferred_lcia = tuple(config.p[u'preferred lcia method'])
-        assert preferred_lcia in methods
-        lca = LCA({(database, code): 1}, method=preferred_lcia)
-        lca.lci(factorize=1)
-        lca.lcia()
-        single_score = lca.score
-    except:
-        preferred_lcia = lca = single_score = False
+    preferred_lcia = tuple(config.p.get(u'preferred lcia method', ()))
+    lca = single_score = False
+    if preferred_lcia in methods:
+        try:
+            lca = factorized_lca({(database, code): 1}, preferred_lcia)
+            single_score = lca.score({(database, code): 1})
+        except Exception:
+            # The page is still useful without scores, e.g. for a singular matrix
+            bw2webapp.logger.exception("LCA of %s failed", (database, code))
+            lca = single_score = False
 
     rp = [x for x in the_activity_data.get('exchanges', []) if x['type'] == "production"]
     if len(rp) == 1:
@@ -368,33 +646,20 @@ def activity_dataset(database, code, sc_graph_json=False):
     else:
         rp = 0
 
-    def format_sc(key):
-        a = get_activity(key)
-        return {
-            'id': "-".join(key),
-            'children': [],
-            'name': a.get('name', "Unknown"),
-            'data': {'url': url_for('activity_dataset-canonical', 
-                database=a.get('database'), 
-                code=a.get('code'))},
-        }
-
-    if request.url_rule.rule[-9:] == "/sc_graph":
-        data = {
-        'id': database + "-" + code,
-        'name': the_activity_data.get('name', "Unknown"),
-        'data': {'origin': True},
-        'children': [
-            format_sc(exc['input'])
-            for exc in the_activity_data.get('exchanges', []) 
-            if 'input' in exc
-            and exc['type'] == "technosphere"
-        ]}
-        print("Supply chain data")
-        print(data)
-        return json_response(data)
-
-    def format_ds(key, amount, biosphere=False):
+    exchanges = list(the_activity.exchanges())
+    scores = [None] * len(exchanges)
+    if lca:
+        # One solve for all exchanges in the technosphere matrix
+        known = lca.known(tuple(x['input']) for x in exchanges)
+        indices = [i for i, x in enumerate(exchanges) if tuple(x['input']) in known]
+        if indices:
+            values = lca.scores([
+                {tuple(exchanges[i]['input']): exchanges[i]['amount']} for i in indices
+            ], [preferred_lcia])[0]
+            for i, value in zip(indices, values.tolist()):
+                scores[i] = value
+
+    def format_ds(key, amount, biosphere=False, score=None):
         a = get_activity(key)
         a_data = a.as_dict()
         data =  {
@@ -408,12 +673,14 @@ def activity_dataset(database, code, sc_graph_json=False):
             'amount': amount
             }
         if lca and not biosphere:
-            lca.redo_lcia({(a.get('database'), a.get('code')): amount})
-            data['score'] = lca.score
+            data['score'] = score
         return data
 
     biosphere = [format_ds(x['input'], x['amount'], True) for x in the_activity.biosphere()]
-    technosphere = [format_ds(x['input'], x['amount']) for x in the_activity.exchanges()]
+    technosphere = [
+        format_ds(x['input'], x['amount'], score=score)
+        for x, score in zip(exchanges, scores)
+    ]
 
     sc_data = {
         'id': database + "-" + code,
@@ -440,18 +707,54 @@ def activity_dataset(database, code, sc_graph_json=False):
     )
 
 
+@bw2webapp.route("/view/<database>/<code>/monte-carlo")
+def activity_monte_carlo(database, code):
+    if database not in databases:
+        return abort(404)
+    try:
+        activity = get_activity((database, code))
+    except KeyError:
+        return abort(404)
+    if "method" in request.args:
+        method = get_method_or_404(request.args["method"])
+    else:
+        method = tuple(config.p.get(u'preferred lcia method', ()))
+        if method not in methods:
+            return abort(404)
+    job_id = get_job_id()
+    status_id = get_job_id()
+    set_job_status(job_id, {
+        "name": "monte-carlo",
+        "project": projects.current,
+        "status": status_id,
+        "activity": [database, code],
+        "method": method,
+        "iterations": config.p.get("iterations", 1000),
+    })
+    set_job_status(status_id, {"status": "Starting..."})
+    return render_template("hist.html", job=job_id, status=status_id,
+        heading="Monte Carlo: %s (%s)" % (activity.get("name", "Unknown"),
+            "-".join(method)),
+        unit=methods[method].get("unit", ""))
+
+
 @bw2webapp.route("/view/<database>/<code>/json")
 def json_editor(database, code):
     if database not in databases:
         return abort(404)
     try:
         data = get_activity((database, code)).as_dict()
-        builder = SchemaBuilder()
-        builder.add_object(data)
-        theschema = builder.to_schema()
     except KeyError:
         return abort(404)
-    return render_template("jsoneditor.html", jsondata=JsonWrapper.dumps(data), jsonchema=theschema)
+    return render_template("jsoneditor.html", jsondata=JsonWrapper.dumps(data),
+        schema_url=url_for("database_schema_json", name=database))
+
+
+@bw2webapp.route("/database/<name>/schema")
+def database_schema_json(name):
+    if name not in databases:
+        return abort(404)
+    return json_response(database_schema(name))
 
 
 ###################
@@ -461,6 +764,14 @@ def json_editor(database, code):
 
 @bw2webapp.route("/database/<database>/facet/<facet>")
 def facet(database, facet):
+    if database not in databases:
+        return abort(404)
+    return flights.do(
+        ("facet", database, facet, dependency_version(database)),
+        lambda: render_facet(database, facet))
+
+
+def render_facet(database, facet):
     def reformat(key, ds):
         return {
             'name': ds.get('name', "Unknown"),
@@ -470,8 +781,6 @@ def facet(database, facet):
             'url': url_for('activity_dataset-canonical', database=key[0], code=key[1]),
         }
 
-    if database not in databases:
-        return abort(404)
     data = Database(database).load()
     facets = {}
     for key, ds in data.items():
@@ -498,39 +807,76 @@ def facet(database, facet):
 ####################
 
 
+def health_check_status_id(database):
+    """Status record id of the health check of the current version of ``database``"""
+    run = (projects.current, health_check_run(database))
+    return hashlib.sha1(repr(run).encode("utf-8")).hexdigest()[:32]
+
+
+def start_job_once(status_id, job_data, retry=False):
+    """Status of the job ``status_id``, started with ``job_data`` if not there yet"""
+    try:
+        status = get_job(status_id)
+    except KeyError:
+        status = None
+    if status is None or (is_finished(status) and (
+            status.get("status") != "error" or retry)):
+        job_id = get_job_id()
+        job_data = dict(job_data, project=projects.current, status=status_id)
+        set_job_status(job_id, job_data)
+        status = {"status": "Queued", "job": job_id}
+        set_job_status(status_id, status)
+        try:
+            dispatch(job_id, job_data)
+        except QueueFull:
+            abort(503)
+    return status
+
+
+def render_health_check(database):
+    """Page with the stored health check result for ``database``, or ``None``"""
+    dhc = health_check_result(database)
+    if dhc is None:
+        return None
+    for obj in ('pr', 'mo', 'me', 'sp', 'nsp', 'ob'):
+        for row in dhc[obj]:
+            row['url'] = url_for(
+                'activity_dataset-canonical',
+                database=row['key'][0], code=row['key'][1])
+        if dhc[obj]:
+            dhc[obj] = JsonWrapper.dumps(dhc[obj])
+    for obj in ('tfn', 'bfn'):
+        dhc[obj] = url_for(
+            'health_check_file', database=database, run=dhc['run'], filename=dhc[obj])
+    return render_template("health-check.html", database=database, **dhc)
+
+
 @bw2webapp.route("/database/<database>/health-check")
 def database_health_check(database):
+    """Stored health check result, or the progress of a new health check job"""
     if database not in databases:
         return abort(404)
-    data = Database(database).load()
-    np = len(data)
-
-    def reformat(key, score=None):
-        ds = data[key]
-        return {
-            'name': ds.get('name', "Unknown"),
-            'categories': ",".join(ds.get('categories', [])),
-            'location': ds.get('location', ''),
-            'unit': ds.get('unit', ''),
-            'url': url_for('activity_dataset-canonical', database=key[0], code=key[1]),
-            'score': score
-        }
+    page = flights.do(
+        ("database_health_check", health_check_run(database)),
+        lambda: render_health_check(database))
+    if page is not None:
+        return page
+    status_id = health_check_status_id(database)
+    status = flights.do(("start_job_once", status_id), lambda: start_job_once(
+        status_id, {"name": "health-check", "database": database},
+        bool(request.args.get("retry"))))
+    return render_template(
+        "health-check-progress.html", database=database, status=status,
+        status_url=url_for("job_status", job=status_id))
 
-    dhc = DatabaseHealthCheck(database).check(get_dynamic_media_folder())
-    dhc['pr'] = JsonWrapper.dumps([reformat(key, score * np) for score, key in dhc['pr'][:20]])
-    dhc['uncertainty'] = sorted([
-        (uncertainty_choices[key].description, value['total'], value['bad'])
-        for key, value in dhc['uncertainty'].items()
-        if value['total']
-    ], key=lambda x: x[1], reverse=True)
-    for obj in ('mo', 'me', 'sp'):
-        if dhc[obj]:
-            dhc[obj] = JsonWrapper.dumps([reformat(key, number) for key, number in dhc[obj]])
-    for obj in ('nsp', 'ob'):
-        if dhc[obj]:
-            dhc[obj] = JsonWrapper.dumps([reformat(key) for key in dhc[obj]])
 
-    return render_template("health-check.html", database=database, **dhc)
+@bw2webapp.route("/database/<database>/health-check/<run>/<filename>")
+def health_check_file(database, run, filename):
+    """Matrix graph of a health check run; the URL changes with the database version"""
+    # ``run`` is a directory name, so only the current run of ``database`` is allowed
+    if database not in databases or run != health_check_run(database):
+        abort(404)
+    return send_from_directory(health_check_directory(run), filename, max_age=31536000)
 
 
 ###########
@@ -542,7 +888,10 @@ def database_health_check(database):
 def activity_names(name):
     if name not in databases:
         return abort(404)
-    return json_response([{
+    # One activity at a time, instead of loading the whole database
+    rows = ActivityDataset.select(ActivityDataset.code, ActivityDataset.data).where(
+        ActivityDataset.database == name).iterator()
+    return json_stream_response({
         "label": u"%s (%s, %s)" % (
             value.get("name", "Unknown"),
             value.get("unit", "Unknown"),
@@ -551,8 +900,17 @@ def activity_names(name):
             "u": value.get("unit", "Unknown"),
             "l": value.get("location", "Unknown"),
             "n": value.get("name", "Unknown"),
-            "k": key
-        }} for key, value in Database(name).load(as_dict=True).items()])
+            "k": (name, row.code)
+        }} for row in rows for value in [row.data])
+
+
+@bw2webapp.route('/api/database/<name>/complete')
+def activity_complete(name):
+    if name not in databases:
+        return abort(404)
+    limit = get_int_arg(request.args, "limit", 20, 1, 100)
+    return json_response(
+        completion_index(name).complete(request.args.get("q", ""), limit))
 
 
 def get_tuple_index(t, i):
@@ -582,30 +940,114 @@ def lca():
             request_data = JsonWrapper.loads(request.data)
         except:
             abort(400)
-        demand = {tuple(o['key']): o['amount'] for o in request_data['activities']}
-        method = tuple(request_data['method'])
-        iterations = config.p.get("iterations", 1000)
-        cpu_count = config.p.get("cpu_cores", None)
-        report = SerializedLCAReport(demand, method, iterations, cpu_count)
-        print("Starting SerializedLCAReport calculation")
-        report.calculate()
-        print("Finished report calculation")
-        if config.p.get('upload_reports', 0):
-            try:
-                report.upload()
-            except:
-                # No online report no cry
-                pass
-        report.write()
-        print(report.uuid)
-        return report.uuid
+        job_data = {
+            "name": "lca-report",
+            "project": projects.current,
+            "demand": [[o['key'], o['amount']] for o in request_data['activities']],
+            "method": request_data['method'],
+            "iterations": config.p.get("iterations", 1000),
+            "cpu_count": config.p.get("cpu_cores", None),
+        }
+        flight_id = hashlib.sha1(JsonWrapper.dumps(
+            [job_data, list(project_version())]).encode("utf-8")).hexdigest()[:32]
+        return flights.do(
+            ("lca", flight_id), lambda: start_lca_report(flight_id, job_data))
+
+
+def start_lca_report(flight_id, job_data):
+    """Id of a new report for ``job_data``, or of the report running as ``flight_id``"""
+    try:
+        report_id = get_job(flight_id)["report"]
+        if not is_finished(get_job(report_id)):
+            return report_id
+    except KeyError:
+        pass
+    report_id = get_job_id()
+    job_id = get_job_id()
+    job_data = dict(job_data, status=report_id)
+    set_job_status(job_id, job_data)
+    set_job_status(report_id, {"status": "Queued", "job": job_id})
+    try:
+        dispatch(job_id, job_data)
+    except QueueFull:
+        abort(503)
+    set_job_status(flight_id, {"report": report_id})
+    return report_id
+
+
+def parse_batch_request(data):
+    """Demands as lists of ``[key, amount]`` pairs, and methods, of a batch request"""
+    demands = [
+        [[tuple(key), float(amount)] for key, amount in demand]
+        for demand in data["demands"]
+    ]
+    lcia_methods = [tuple(method) for method in data["methods"]]
+    if not demands or not lcia_methods or not all(demands):
+        raise ValueError("Empty demands or methods")
+    return demands, lcia_methods
+
+
+@bw2webapp.route('/api/lca/batch', methods=["POST"])
+def lca_batch():
+    """Scores for every combination of the given demands and methods, or a 202 job"""
+    try:
+        demands, lcia_methods = parse_batch_request(JsonWrapper.loads(request.data))
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+    if any(method not in methods for method in lcia_methods) or any(
+            key[0] not in databases for demand in demands for key, _ in demand):
+        abort(404)
+    if len(demands) <= preferences.get("web lca batch inline", 100):
+        try:
+            scores = batch_scores(
+                [dict(demand) for demand in demands], lcia_methods)
+        except KeyError:
+            # Activity not in the technosphere matrix
+            abort(404)
+        return json_stream_response({
+            "methods": lcia_methods,
+            "scores": (row.tolist() for row in scores),
+        })
+    status_id = get_job_id()
+    job_id = get_job_id()
+    job_data = {
+        "name": "lca-batch",
+        "project": projects.current,
+        "status": status_id,
+        "demands": demands,
+        "methods": lcia_methods,
+    }
+    set_job_status(job_id, job_data)
+    set_job_status(status_id, {"status": "Queued", "job": job_id})
+    try:
+        dispatch(job_id, job_data)
+    except QueueFull:
+        abort(503)
+    return json_response({
+        "job": job_id,
+        "status": status_id,
+        "url": url_for("job_status", job=status_id),
+    }), 202
 
 
 @bw2webapp.route('/report/<uuid>')
 def report(uuid):
-    data = open(os.path.join(
-        config.dir, "reports", "report.%s.json" % uuid)).read()
-    return render_template("report.html", data=data)
+    try:
+        status = get_job(uuid)
+    except KeyError:
+        status = None
+    else:
+        if status.get("status") == "finished":
+            status = None
+    filepath = os.path.join(
+        projects.request_directory("reports"), "report.%s.json" % uuid)
+    if not os.path.exists(filepath):
+        if status is None:
+            abort(404)
+        return render_template("report-progress.html", uuid=uuid, status=status)
+    with open(filepath, encoding="utf-8") as f:
+        data = f.read()
+    return render_template("report.html", data=data, uuid=uuid, status=status)
 
 
 ###############
@@ -617,89 +1059,98 @@ def report(uuid):
 # def method_explorer():
 
 
+def get_method_or_404(abbreviation):
+    try:
+        return method_abbreviations()[abbreviation]
+    except KeyError:
+        abort(404)
+
+
+def format_cf(row):
+    row = dict(row)
+    database, code = row.pop(u'database'), row.pop(u'code')
+    row[u'url'] = None
+    # Flows given by id which no longer exist have no page
+    if database and code:
+        row[u'url'] = url_for(
+            'activity_dataset-canonical', database=database, code=code)
+    return row
+
+
 @bw2webapp.route("/method/<abbreviation>")
 def method_explorer(abbreviation):
-    method = [key for key, value in methods.items()
-        if value[u'abbreviation'] == abbreviation]
-    if not len(method) == 1:
-        abort(404)
-    method = method[0]
+    method = get_method_or_404(abbreviation)
+    return flights.do(
+        ("method_explorer", method, methods[method].get("modified")),
+        lambda: render_method(method, abbreviation))
+
+
+def render_method(method, abbreviation):
     meta = methods[method]
-    json_data = []
-    for values in Method(method).load():
-        if len(values) >= 3:
-            key, value, geo = values[:3]
-        else:
-            key, value = values[:2]
-            geo = config.global_location
-        flow = Database(key[0]).load()[key]
-        json_data.append({
-            u'name': flow.get(u'name', u"Unknown"),
-            u'unit': flow.get(u'unit', ''),
-            u'categories': ",".join(flow.get(u'categories', [])),
-            u'cf': value[u'amount'] if isinstance(value, dict) else value,
-            u'location': geo,
-            u'url': url_for('activity_dataset-canonical', database=key[0], code=key[1])
-        })
-    json_data.sort(key=lambda x: x[u'name'])
+    state, json_data = table_page(method_cfs(method), {}, format_cf)
     return render_template(
         "method.html",
         name=method,
         unit=meta.get(u'unit', u''),
         description=meta.get(u'description', u''),
-        data=JsonWrapper.dumps(json_data)
+        data=JsonWrapper.dumps(json_data),
+        state=JsonWrapper.dumps(state),
+        cfs_url=url_for("method_cfs_table", abbreviation=abbreviation)
     )
 
+
+@bw2webapp.route("/method/<abbreviation>/cfs")
+def method_cfs_table(abbreviation):
+    method = get_method_or_404(abbreviation)
+    return json_response(table_page(method_cfs(method), request.args, format_cf))
+
 ###################
 ### Development ###
 ###################
 
 
-def short_name(name):
-    return " ".join(name.split(" ")[:3])[:25]
+MAX_TREE_DEPTH = 4
+
+
+def tree_max_nodes():
+    # Hub processes can have hundreds of inputs, so depth alone doesn't bound the tree
+    return preferences.get("web tree max nodes", 500)
+
+
+def get_tree_key_or_404(name, code, direction):
+    if name not in databases or direction not in ("forwards", "backwards"):
+        abort(404)
+    if code not in short_names(name):
+        abort(404)
+    return (name, code)
 
 
 @bw2webapp.route("/database/tree/<name>/<code>")
 @bw2webapp.route("/database/tree/<name>/<code>/<direction>")
 def database_tree(name, code, direction="backwards"):
-    def format_d(d):
-        return [{"name": short_name(data[k]["name"]),
-            "children": format_d(v) if isinstance(v, dict) \
-                else [{"name": short_name(data[x]["name"])} for x in v]
-            } for k, v in d.items()]
-
-    if name not in databases:
-        abort(404)
-    explorer = DatabaseExplorer(name)
-    data = Database(name).load()
-    if (name, code) not in data:
-        try:
-            code = int(code)
-            assert (name, code) in data
-        except:
-            return abort(404)
-    if direction == "forwards":
-        nodes = explorer.uses_this_process((name, code), 1)
-    else:
-        nodes = explorer.provides_this_process((name, code), 1)
-    for db in databases[name]["depends"]:
-        data.update(Database(db).load())
-    formatted = {
-        "name": short_name(data[(name, code)]["name"]),
-        "children": format_d(nodes)
-    }
-    pprint.pprint(formatted)
+    key = get_tree_key_or_404(name, code, direction)
+    depth = get_int_arg(request.args, "depth", 2, 0, MAX_TREE_DEPTH)
     return render_template("database_tree.html",
-        f=formatted,
-        activity=data[(name, code)]["name"],
-        direction=direction.title())
+        f=activity_tree(key, direction, depth, tree_max_nodes()),
+        activity=get_activity(key).get("name", "Unknown"),
+        direction=direction.title(),
+        json_url=url_for("database_tree_json", name="__DB__", code="__CODE__",
+            direction=direction))
+
+
+@bw2webapp.route("/database/tree/<name>/<code>/<direction>/json")
+def database_tree_json(name, code, direction):
+    key = get_tree_key_or_404(name, code, direction)
+    depth = get_int_arg(request.args, "depth", 1, 0, MAX_TREE_DEPTH)
+    return json_response(activity_tree(key, direction, depth, tree_max_nodes()))
 
 
 @bw2webapp.route('/progress')
 def progress_test():
     job_id = get_job_id()
     status_id = get_job_id()
-    set_job_status(job_id, {"name": "progress-test", "status": status_id})
+    set_job_status(job_id, {"name": "progress-test", "project": projects.current,
+        "status": status_id})
     set_job_status(status_id, {"status": "Starting..."})
     return render_template("progress.html", **{"job": job_id,
         'status': status_id})
@@ -709,7 +1160,8 @@ def progress_test():
 def hist_test():
     job_id = get_job_id()
     status_id = get_job_id()
-    set_job_status(job_id, {"name": "hist-test", "status": status_id})
+    set_job_status(job_id, {"name": "hist-test", "project": projects.current,
+        "status": status_id})
     set_job_status(status_id, {"status": "Starting..."})
     return render_template("hist.html", **{"job": job_id, 'status': status_id})
 
@@ -0,0 +1,119 @@
+from bw2ui.web import cache as cache_module
+from bw2ui.web.cache import SingleFlight, VersionedCache
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+import threading
+import time
+
+
+class Builder(object):
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+@pytest.fixture
+def disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        cache_module.projects, "request_directory",
+        lambda name: str(tmp_path), raising=False)
+    return tmp_path
+
+
+def test_cache_builds_once_per_version():
+    cache, builder = VersionedCache(), Builder([1, 2])
+    assert cache.get(("a",), 1, builder) == [1, 2]
+    assert cache.get(("a",), 1, builder) == [1, 2]
+    assert builder.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.get(("a",), 2, builder)
+    assert builder.calls == 2
+    assert len(cache) == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = VersionedCache(maxsize=2)
+    for key in "abc":
+        cache.get((key,), 1, Builder(key))
+        cache.get(("a",), 1, Builder(None))
+    assert sorted(key[-1] for key in cache.data) == ["a", "c"]
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_cache_disk_shared_between_caches(disk):
+    first, second = VersionedCache(), VersionedCache()
+    first.enable_disk()
+    second.enable_disk()
+    first.get(("a",), 1, Builder({"x": 1}))
+    builder = Builder(None)
+    assert second.get(("a",), 1, builder) == {"x": 1}
+    assert builder.calls == 0
+    assert second.disk_hits == 1
+    assert second.get(("a",), 2, Builder({"x": 2})) == {"x": 2}
+
+
+def test_cache_disk_maps_arrays(disk):
+    first, second = VersionedCache(), VersionedCache()
+    first.enable_disk()
+    second.enable_disk()
+    first.get(("a",), 1, Builder(np.arange(5)))
+    value = second.get(("a",), 1, Builder(None))
+    assert isinstance(value, np.memmap)
+    assert value.tolist() == [0, 1, 2, 3, 4]
+    first.get(("a",), 2, Builder(np.arange(3)))
+    assert len(list(disk.glob("*.npy"))) == 1
+
+
+def test_cache_local_values_stay_in_memory(disk):
+    cache = VersionedCache()
+    cache.enable_disk()
+    cache.get(("a",), 1, Builder(lambda: None), local=True)
+    assert not list(disk.iterdir())
+
+
+def test_single_flight_shares_result():
+    flights, started, release = SingleFlight(), threading.Event(), threading.Event()
+    builder = Builder(42)
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return builder()
+
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(flights.do, ("a",), slow)
+        assert started.wait(5)
+        followers = [executor.submit(flights.do, ("a",), slow) for _ in range(3)]
+        while flights.shared < 3:
+            time.sleep(0.01)
+        release.set()
+        assert [f.result(5) for f in [leader] + followers] == [42] * 4
+    assert builder.calls == 1
+    assert len(flights) == 0
+
+
+def test_single_flight_shares_errors():
+    flights, started, release = SingleFlight(), threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("broken")
+
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(flights.do, ("a",), fail)
+        assert started.wait(5)
+        follower = executor.submit(flights.do, ("a",), fail)
+        while not flights.shared:
+            time.sleep(0.01)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result(5)
+    assert flights.do(("a",), lambda: 1) == 1
@@ -0,0 +1,116 @@
+from bw2ui.web.engine import JobCancelled, JobEngine, QueueFull, StatusStore
+import threading
+import time
+import pytest
+
+
+def test_store_set_and_update():
+    store = StatusStore()
+    store.set("a", {"state": "queued"})
+    store.update("a", state="running", progress=1)
+    assert store.get("a") == {"state": "running", "progress": 1}
+    with pytest.raises(KeyError):
+        store.get("b")
+
+
+def test_store_wait_returns_new_version():
+    store = StatusStore()
+    store.set("a", {"progress": 0})
+    version, status = store.wait("a", 0, timeout=1)
+    assert version == 1
+    threading.Timer(0.05, store.set, ("a", {"progress": 1})).start()
+    version, status = store.wait("a", version, timeout=5)
+    assert version == 2
+    assert status == {"progress": 1}
+
+
+def test_store_expire_keeps_recent_and_kept():
+    store = StatusStore()
+    for job in "abc":
+        store.set(job, {})
+    store.updated["a"] = store.updated["b"] = time.time() - 100
+    store.cancel("a")
+    store.expire(10, keep={"b"})
+    assert sorted(store.data) == ["b", "c"]
+    assert not store.is_cancelled("a")
+
+
+def test_store_sqlite(tmp_path):
+    filepath = str(tmp_path / "jobs.sqlite")
+    StatusStore(filepath).set("a", {"progress": 1})
+    shared = StatusStore(filepath, shared=True)
+    assert shared.get("a") == {"progress": 1}
+    shared.cancel("a")
+    assert StatusStore(filepath, shared=True).is_cancelled("a")
+
+
+def test_store_shared_needs_file():
+    with pytest.raises(ValueError):
+        StatusStore(shared=True)
+
+
+def test_engine_runs_job():
+    engine = JobEngine(StatusStore(), workers=1, queue_size=0)
+    engine.store.set("a", {})
+    assert engine.submit("a", lambda x: x * 2, 21).result(5) == 42
+    assert engine.get_status("a")["state"] == "finished"
+
+
+def test_engine_records_errors():
+    def fail():
+        raise ValueError("broken")
+
+    engine = JobEngine(StatusStore(), workers=1, queue_size=0)
+    engine.store.set("a", {"status": "s"})
+    engine.submit("a", fail).result(5)
+    assert engine.get_status("a")["state"] == "error"
+    assert engine.get_status("s") == {
+        "status": "error", "finished": True, "error": "broken"}
+
+
+def test_engine_queue_full():
+    release = threading.Event()
+    engine = JobEngine(StatusStore(), workers=1, queue_size=0)
+    engine.store.set("a", {})
+    engine.store.set("b", {})
+    engine.submit("a", release.wait, 5)
+    with pytest.raises(QueueFull):
+        engine.submit("b", lambda: None)
+    release.set()
+    deadline = time.time() + 5
+    while engine.futures and time.time() < deadline:
+        time.sleep(0.01)
+    engine.submit("b", lambda: None).result(5)
+
+
+def test_engine_cancel_running_job():
+    started = threading.Event()
+
+    def job():
+        started.set()
+        while True:
+            engine.set_status("s", {"progress": 1})
+            time.sleep(0.01)
+
+    engine = JobEngine(StatusStore(), workers=1, queue_size=0)
+    engine.store.set("a", {"status": "s"})
+    future = engine.submit("a", job)
+    assert started.wait(5)
+    assert engine.cancel("a")
+    future.result(5)
+    assert engine.get_status("a")["state"] == "cancelled"
+    assert engine.get_status("s")["cancelled"]
+    with pytest.raises(JobCancelled):
+        engine.set_status("s", {})
+
+
+def test_engine_cleanup_keeps_running_jobs():
+    release = threading.Event()
+    engine = JobEngine(StatusStore(), workers=1, queue_size=1, ttl=10)
+    for job in "ab":
+        engine.store.set(job, {})
+    engine.submit("a", release.wait, 5)
+    engine.store.updated["a"] = engine.store.updated["b"] = time.time() - 100
+    engine.cleanup(force=True)
+    assert sorted(engine.store.data) == ["a"]
+    release.set()
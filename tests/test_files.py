@@ -0,0 +1,60 @@
+from bw2ui.web.files import DirectoryLister
+import pytest
+
+
+@pytest.fixture
+def directory(tmp_path):
+    for index in range(25):
+        (tmp_path / ("file%02d.csv" % index)).write_text("")
+    (tmp_path / "Sub").mkdir()
+    (tmp_path / ".hidden").write_text("")
+    return str(tmp_path)
+
+
+def read_all(lister, path, limit):
+    pages, cursor = [], None
+    while True:
+        entries, cursor = lister.listing(path, cursor, limit=limit)
+        pages.append(entries)
+        if cursor is None:
+            return pages
+
+
+def test_listing_pages(directory):
+    pages = read_all(DirectoryLister(), directory, 10)
+    assert [len(page) for page in pages] == [10, 10, 6]
+    names = [entry["name"] for page in pages for entry in page]
+    assert sorted(names) == ["Sub"] + ["file%02d.csv" % i for i in range(25)]
+
+
+def test_listing_entries(directory):
+    entries, cursor = DirectoryLister().listing(directory, limit=100)
+    assert cursor is None
+    assert entries[0]["dir"] and entries[0]["name"] == "Sub"
+    assert "ext" not in entries[0]
+    assert entries[1]["ext"] == "csv"
+    assert not any(entry["name"].startswith(".") for entry in entries)
+
+
+def test_listing_resumes_expired_cursor(directory):
+    entries, cursor = DirectoryLister().listing(directory, limit=10)
+    rest, cursor = DirectoryLister().listing(directory, cursor, limit=100)
+    assert cursor is None
+    names = {entry["name"] for entry in entries + rest}
+    assert len(names) == 26
+
+
+def test_listing_closes_old_listings(directory):
+    lister = DirectoryLister(max_open=2)
+    for _ in range(3):
+        lister.listing(directory, limit=1)
+    assert len(lister.listings) == 2
+
+
+def test_listing_invalid_cursor(directory):
+    with pytest.raises(ValueError):
+        DirectoryLister().listing(directory, "token-abc")
+
+
+def test_listing_missing_directory(tmp_path):
+    assert DirectoryLister().listing(str(tmp_path / "missing")) == ([], None)
@@ -0,0 +1,48 @@
+from bw2ui.web.indexes import CompletionIndex
+
+
+def entry(name, unit="kg", location="GLO"):
+    return {"n": name, "u": unit, "l": location, "k": ["db", name]}
+
+
+def names(results):
+    return [result["value"]["n"] for result in results]
+
+
+def index():
+    return CompletionIndex([
+        entry("Steel production"),
+        entry("steel"),
+        entry("Electricity, high voltage", "kWh", "CH"),
+        entry("Electricity, low voltage", "kWh", "CH"),
+        entry("Transport, lorry"),
+    ])
+
+
+def test_complete_empty_query():
+    assert index().complete("  ") == []
+
+
+def test_complete_exact_match_first():
+    assert names(index().complete("Steel")) == ["steel", "Steel production"]
+
+
+def test_complete_matches_words():
+    assert names(index().complete("low volt")) == ["Electricity, low voltage"]
+    assert names(index().complete("voltage")) == [
+        "Electricity, low voltage", "Electricity, high voltage"]
+
+
+def test_complete_no_match():
+    assert index().complete("copper") == []
+    assert index().complete("steel copper") == []
+
+
+def test_complete_limit():
+    assert len(index().complete("e", limit=2)) == 2
+
+
+def test_complete_label():
+    result = index().complete("transport")[0]
+    assert result["label"] == "Transport, lorry (kg, GLO)"
+    assert result["value"]["k"] == ["db", "Transport, lorry"]
@@ -0,0 +1,79 @@
+from bw2ui.web import responses
+from datetime import datetime, timedelta, timezone
+from flask import Flask, request
+from werkzeug.http import http_date
+import pytest
+
+MODIFIED = datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+app = Flask(__name__)
+app.add_url_rule("/", "index", lambda: "")
+app.add_url_rule("/database/<name>", "database_explorer", lambda name: "")
+app.add_url_rule("/other", "other", lambda: "")
+
+
+@pytest.fixture(autouse=True)
+def project(monkeypatch):
+    version = ["default", 1]
+    monkeypatch.setattr(responses, "project_version", lambda: tuple(version))
+    monkeypatch.setattr(responses, "project_last_modified", lambda: MODIFIED)
+    return version
+
+
+def conditional(path, method="GET", **headers):
+    headers = {key.replace("_", "-"): value for key, value in headers.items()}
+    with app.test_request_context(path, method=method, headers=headers):
+        return responses.conditional_response(request)
+
+
+def current_etag():
+    with app.test_request_context("/database/db"):
+        response = app.response_class("page")
+        responses.finish_response(request, response)
+    assert response.cache_control.no_cache and response.cache_control.private
+    assert response.last_modified == MODIFIED
+    return response.headers["ETag"]
+
+
+def test_etag_match():
+    response = conditional("/database/db", If_None_Match=current_etag())
+    assert response.status_code == 304
+    assert response.headers["ETag"] == current_etag()
+    assert conditional("/database/db", "HEAD", If_None_Match=current_etag())
+
+
+def test_etag_changes_with_project_data(project):
+    etag = current_etag()
+    project[1] += 1
+    assert current_etag() != etag
+    assert conditional("/database/db", If_None_Match=etag) is None
+
+
+def test_etag_takes_precedence():
+    assert conditional(
+        "/database/db", If_None_Match='W/"other"',
+        If_Modified_Since=http_date(MODIFIED)) is None
+
+
+def test_if_modified_since():
+    assert conditional(
+        "/database/db", If_Modified_Since=http_date(MODIFIED)).status_code == 304
+    assert conditional(
+        "/database/db",
+        If_Modified_Since=http_date(MODIFIED - timedelta(seconds=1))) is None
+
+
+def test_undated_endpoints_need_etag():
+    assert conditional("/", If_Modified_Since=http_date(MODIFIED)) is None
+    with app.test_request_context("/"):
+        response = app.response_class("page")
+        responses.finish_response(request, response)
+    assert response.last_modified is None
+    assert conditional("/", If_None_Match=response.headers["ETag"]).status_code == 304
+
+
+def test_unversioned_requests():
+    etag = current_etag()
+    assert conditional("/other", If_None_Match=etag) is None
+    assert conditional("/database/db", "POST", If_None_Match=etag) is None
+    assert conditional("/database/db") is None
@@ -0,0 +1,104 @@
+from bw2ui.web.sketches import MonteCarloSummary, P2Quantile, StreamingHistogram
+import numpy as np
+import pytest
+
+
+def total(histogram):
+    return int(histogram.counts.sum())
+
+
+def test_histogram_needs_even_bins():
+    with pytest.raises(ValueError):
+        StreamingHistogram(bins=5)
+
+
+def test_histogram_warmup_buffers_samples():
+    histogram = StreamingHistogram(bins=10, warmup=100)
+    histogram.add(np.arange(50))
+    assert histogram.lower is None
+    assert total(histogram) == 0
+    histogram.add(np.arange(50, 100))
+    assert total(histogram) == 100
+    assert histogram.lower == 0
+
+
+def test_histogram_grows_range():
+    histogram = StreamingHistogram(bins=10, warmup=10)
+    histogram.add(np.linspace(0, 1, 10))
+    histogram.add([-5, 20])
+    assert total(histogram) == 12
+    assert histogram.lower <= -5
+    assert histogram.upper > 20
+
+
+def test_histogram_fixed_range():
+    histogram = StreamingHistogram(bins=10, lower=0, upper=10)
+    histogram.add([-1, 0, 5, 9.99, 10, 11])
+    assert histogram.underflow == 1
+    assert histogram.overflow == 2
+    assert total(histogram) == 3
+
+
+@pytest.mark.parametrize("value", [np.inf, -np.inf, np.nan])
+def test_histogram_nonfinite(value):
+    histogram = StreamingHistogram(bins=10, warmup=10)
+    histogram.add(np.linspace(0, 1, 10))
+    histogram.add([0.5, value])
+    assert histogram.nonfinite == 1
+    assert total(histogram) == 11
+    assert np.isfinite(histogram.lower) and np.isfinite(histogram.width)
+
+
+def test_histogram_nonfinite_during_warmup():
+    histogram = StreamingHistogram(bins=10, warmup=10)
+    histogram.add([np.nan, np.inf] + list(range(10)))
+    assert histogram.nonfinite == 2
+    assert total(histogram) == 10
+    assert histogram.lower == 0
+
+
+def test_histogram_only_nonfinite():
+    histogram = StreamingHistogram(bins=10, warmup=1)
+    histogram.add([1, 2])
+    histogram.add([np.nan, np.inf])
+    assert histogram.nonfinite == 2
+    assert total(histogram) == 2
+
+
+def test_histogram_points():
+    histogram = StreamingHistogram(bins=10, lower=0, upper=10)
+    assert histogram.points() == []
+    histogram.add([2.5, 2.5, 7.5])
+    points = histogram.points()
+    assert points[0] == {"x": 2.5, "y": 2}
+    assert points[-1] == {"x": 7.5, "y": 1}
+
+
+def test_p2_quantile():
+    values = np.random.default_rng(42).normal(size=10000)
+    median = P2Quantile(0.5)
+    upper = P2Quantile(0.975)
+    for x in values:
+        median.add(x)
+        upper.add(x)
+    assert median.value() == pytest.approx(0, abs=0.05)
+    assert upper.value() == pytest.approx(1.96, abs=0.1)
+
+
+def test_p2_quantile_few_samples():
+    quantile = P2Quantile(0.5)
+    assert quantile.value() is None
+    for x in (3, 1, 2):
+        quantile.add(x)
+    assert quantile.value() == 2
+
+
+def test_summary_leaves_out_nonfinite():
+    summary = MonteCarloSummary(bins=10)
+    summary.add(np.arange(200, dtype=float))
+    summary.add([np.nan, np.inf, -np.inf])
+    result = summary.as_dict()
+    assert result["iterations"] == 203
+    assert result["nonfinite"] == 3
+    assert result["statistics"]["mean"] == pytest.approx(99.5)
+    assert result["statistics"]["max"] == 199
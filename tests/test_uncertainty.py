@@ -0,0 +1,60 @@
+from bw2ui.uncertainty import NOT_GIVEN, params_array, summarize
+import numpy as np
+
+
+def by_id(summary):
+    return {row["id"]: row for row in summary}
+
+
+def test_params_array_defaults():
+    params = params_array([
+        {"amount": 1},
+        {"amount": "2", "uncertainty type": None, "negative": True},
+        {"amount": None, "uncertainty type": 1000},
+    ])
+    assert params["uncertainty_type"].tolist() == [NOT_GIVEN] * 3
+    assert params["amount"][1] == 2
+    assert np.isnan(params["amount"][2])
+    assert params["negative"].tolist() == [False, True, False]
+
+
+def test_summarize_counts_and_order():
+    summary = summarize(params_array(
+        [{"amount": 1}] * 3
+        + [{"amount": 1, "uncertainty type": 3, "loc": 1, "scale": 0.1}]
+    ))
+    assert [(row["id"], row["total"]) for row in summary] == [(NOT_GIVEN, 3), (3, 1)]
+    assert summary[0]["name"] == "No uncertainty information"
+    assert summary[0]["statistic"] is None
+    assert summary[0]["quartiles"] is None
+
+
+def test_summarize_lognormal():
+    summary = by_id(summarize(params_array([
+        {"amount": 1, "uncertainty type": 2, "loc": 0, "scale": 0.5},
+        {"amount": 10, "uncertainty type": 2, "loc": np.log(10), "scale": 1.5},
+        # ``loc`` doesn't match ``amount``
+        {"amount": 1, "uncertainty type": 2, "loc": 3, "scale": 0.5},
+        {"amount": 1, "uncertainty type": 2, "loc": 0, "scale": 0},
+    ])))
+    row = summary[2]
+    assert row["total"] == 4
+    assert row["bad"] == 2
+    assert row["statistic"] == "scale"
+    assert row["quartiles"]["min"] == 0.5
+    assert row["quartiles"]["max"] == 1.5
+    assert row["quartiles"]["median"] == 1
+
+
+def test_summarize_relative_width():
+    summary = by_id(summarize(params_array([
+        {"amount": 2, "uncertainty type": 4, "minimum": 1, "maximum": 3},
+        {"amount": -4, "uncertainty type": 4, "minimum": -6, "maximum": -2},
+        {"amount": 1, "uncertainty type": 4, "minimum": 3, "maximum": 1},
+        {"amount": 2, "uncertainty type": 5, "loc": 5, "minimum": 1, "maximum": 3},
+    ])))
+    assert summary[4]["bad"] == 1
+    assert summary[4]["statistic"] == "relative width"
+    assert summary[4]["quartiles"]["min"] == summary[4]["quartiles"]["max"] == 1
+    assert summary[5]["bad"] == 1
+    assert summary[5]["quartiles"] is None